@@ -0,0 +1,136 @@
+"""
+Compares the PointIndex behind Layout against the quadtree of Nodes it replaced, on layouts
+with tens of thousands of points recorded along a random walk.
+
+Run from the root of the repository:
+    python -m benchmarks.layout [--points N] [--queries N]
+
+Points are added in walk order, which is how layouts are recorded in game and which degrades
+the quadtree into long chains. The quadtree is reimplemented iteratively here so that deep
+chains do not exceed Python's recursion limit. Range queries have the sizes of the searches
+made by Layout.add and Layout.shortest_path.
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from src.common import settings
+from src.routine.layout import Layout, Node, PointIndex
+
+
+class QuadTree:
+    """The quadtree that Layout used before PointIndex, without recursion."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, x, y):
+        if self.root is None:
+            self.root = Node(x, y)
+            return
+        node = self.root
+        while True:
+            if y >= node.y and x < node.x:
+                side = 'up_left'
+            elif y >= node.y and x >= node.x:
+                side = 'up_right'
+            elif y < node.y and x < node.x:
+                side = 'down_left'
+            else:
+                side = 'down_right'
+            child = getattr(node, side)
+            if child is None:
+                setattr(node, side, Node(x, y))
+                return
+            node = child
+
+    def search(self, x_min, x_max, y_min, y_max):
+        nodes = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            if x_min <= node.x <= x_max and y_min <= node.y <= y_max:
+                nodes.append(node)
+            if x_min < node.x:
+                if y_min < node.y and node.down_left:
+                    stack.append(node.down_left)
+                if y_max >= node.y and node.up_left:
+                    stack.append(node.up_left)
+            if x_max >= node.x:
+                if y_min < node.y and node.down_right:
+                    stack.append(node.down_right)
+                if y_max >= node.y and node.up_right:
+                    stack.append(node.up_right)
+        return nodes
+
+
+def random_walk(rng, count):
+    """Returns COUNT distinct points visited in order along a random walk across the map."""
+
+    steps = rng.normal(0, 0.002, (count, 2))
+    points = 0.5 + np.cumsum(steps, axis=0)
+    points = np.abs((points + 1) % 2 - 1)       # Reflect the walk off the edges of the map
+    return [tuple(p) for p in points.tolist()]
+
+
+def random_queries(rng, count):
+    """Returns COUNT range queries shaped like those made while adding points and pathing."""
+
+    tolerance = settings.move_tolerance
+    delta = tolerance / math.sqrt(2)
+    queries = []
+    for x, y in rng.random((count, 2)).tolist():
+        kind = len(queries) % 3
+        if kind == 0:       # Collision check in Layout.add
+            half = Layout.TOLERANCE
+            queries.append((x - half, x + half, y - half, y + half))
+        elif kind == 1:     # Horizontal teleport
+            queries.append((x + tolerance / 4, x + tolerance * 2, y - delta, y + delta))
+        else:               # Vertical teleport
+            queries.append((x - delta, x + delta, y + tolerance / 4, 1))
+    return queries
+
+
+def timed(function, items):
+    """Calls FUNCTION on every tuple in ITEMS and returns the results and total time taken."""
+
+    start = time.perf_counter()
+    results = [function(*item) for item in items]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--points', type=int, default=50000, help='the number of points')
+    parser.add_argument('--queries', type=int, default=3000, help='the number of range queries')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    points = random_walk(rng, args.points)
+    queries = random_queries(rng, args.queries)
+
+    tree, index = QuadTree(), PointIndex()
+    _, tree_add = timed(tree.add, points)
+    _, index_add = timed(index.add, points)
+    tree_results, tree_search = timed(tree.search, queries)
+    index_results, index_search = timed(index.search, queries)
+
+    mismatches = sum(sorted(map(tuple, t)) != sorted(map(tuple, i.tolist()))
+                     for t, i in zip(tree_results, index_results))
+    found = sum(len(r) for r in index_results) / len(queries)
+
+    print(f'{len(points)} points, {len(queries)} queries ({found:.1f} points found on average)')
+    print(f"{'':<12}{'add':>14}{'search':>14}")
+    print(f"{'quadtree':<12}{1e6 * tree_add / len(points):>11.2f} us"
+          f"{1e6 * tree_search / len(queries):>11.2f} us")
+    print(f"{'PointIndex':<12}{1e6 * index_add / len(points):>11.2f} us"
+          f"{1e6 * index_search / len(queries):>11.2f} us")
+    print(f"{'speedup':<12}{tree_add / index_add:>13.1f}x{tree_search / index_search:>13.1f}x")
+    print(f'{mismatches} queries returned different points')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Compares the accuracy and speed of the coarse-to-fine pyramid matchers in utils against
+single_match and multi_match_nms on the full-frame searches Auto Maple performs.
+
+Run from the root of the repository:
+    python -m benchmarks.matching [--frames PATH] [--runs N] [--levels N]
+
+Without --frames, synthetic frames are generated by pasting each template at known positions
+onto textured noise, and accuracy is measured against those positions. With --frames, the
+recorded frames at PATH (any recording accepted by ReplayFrameSource) are used instead and
+the pyramid matchers are scored by how often they agree with the exhaustive ones.
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from src.common import utils
+from src.common.templates import templates
+from src.common.frame_sources import ReplayFrameSource
+
+
+# Size of synthetic frames, matching the default game resolution
+FRAME_WIDTH = 1366
+FRAME_HEIGHT = 768
+
+# Number of copies of each template pasted into a synthetic frame for multi-match searches
+COPIES = 3
+
+# Maximum distance (in pixels) between a match and the true position for it to count
+TOLERANCE = 1
+
+
+def synthetic_frame(rng, template, copies):
+    """Returns a noisy grayscale frame containing COPIES non-overlapping copies of TEMPLATE."""
+
+    noise = rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH), dtype=np.uint8)
+    frame = cv2.GaussianBlur(noise, (5, 5), 0)
+    height, width = template.shape
+    positions = []
+    while len(positions) < copies:
+        x = int(rng.integers(0, FRAME_WIDTH - width))
+        y = int(rng.integers(0, FRAME_HEIGHT - height))
+        if all(abs(x - p[0]) >= width or abs(y - p[1]) >= height for p in positions):
+            frame[y:y + height, x:x + width] = template
+            positions.append((x, y))
+    return frame, positions
+
+
+def recorded_frames(path, count):
+    """Returns up to COUNT grayscale frames from the recording at PATH."""
+
+    class Ring:
+        def next(self, height, width):
+            return np.empty((height, width, 4), dtype=np.uint8)
+
+    source = ReplayFrameSource(path, loop=False)
+    frames = []
+    while len(frames) < count:
+        buffer = source.grab(Ring())
+        if buffer is None:
+            break
+        frames.append(cv2.cvtColor(buffer, cv2.COLOR_BGRA2GRAY))
+    source.release()
+    return frames
+
+
+def timed(function, *args, **kwargs):
+    """Returns the result of calling FUNCTION and how long (in seconds) the call took."""
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name, exact_times, pyramid_times, exact_correct, pyramid_correct, total):
+    exact = np.mean(exact_times) * 1000
+    pyramid = np.mean(pyramid_times) * 1000
+    total = max(total, 1)
+    print(f'{name:<24}{exact:>10.2f} ms{pyramid:>10.2f} ms{exact / pyramid:>9.1f}x'
+          f'{100 * exact_correct / total:>10.1f}%{100 * pyramid_correct / total:>10.1f}%')
+
+
+def is_close(a, b):
+    """Returns whether positions A and B are within TOLERANCE pixels of each other."""
+
+    return abs(a[0] - b[0]) <= TOLERANCE and abs(a[1] - b[1]) <= TOLERANCE
+
+
+def count_found(expected, matches):
+    """Returns how many of the EXPECTED positions are close to one of MATCHES."""
+
+    return sum(any(is_close(e, m) for m in matches) for e in expected)
+
+
+def benchmark_single(name, frames, levels):
+    """Compares single_match against pyramid_single_match for the named template."""
+
+    template = templates[name]
+    exact_times, pyramid_times, exact_correct, pyramid_correct = [], [], 0, 0
+    for frame, truth in frames:
+        exact, exact_time = timed(utils.single_match, frame, template)
+        pyramid, pyramid_time = timed(utils.pyramid_single_match, frame, template, levels=levels)
+        exact_times.append(exact_time)
+        pyramid_times.append(pyramid_time)
+        expected = truth[0] if truth else exact[0]
+        exact_correct += is_close(exact[0], expected)
+        pyramid_correct += is_close(pyramid[0], expected)
+    report(f'single {name}', exact_times, pyramid_times,
+           exact_correct, pyramid_correct, len(frames))
+
+
+def benchmark_multi(name, frames, threshold, levels):
+    """Compares multi_match_nms against pyramid_multi_match for the named template."""
+
+    template = templates[name]
+    height, width = template.shape
+    exact_times, pyramid_times, exact_correct, pyramid_correct, total = [], [], 0, 0, 0
+    for frame, truth in frames:
+        exact, exact_time = timed(utils.multi_match_nms, frame, template, threshold)
+        pyramid, pyramid_time = timed(utils.pyramid_multi_match, frame, template, threshold,
+                                      levels=levels)
+        exact_times.append(exact_time)
+        pyramid_times.append(pyramid_time)
+        if truth:
+            expected = [(x + width / 2, y + height / 2) for x, y in truth]
+        else:
+            expected = [(x, y) for x, y, _ in exact]
+
+        # Spurious matches count against accuracy as well as missed ones
+        total += max(len(expected), len(exact), len(pyramid))
+        exact_correct += count_found(expected, exact)
+        pyramid_correct += count_found(expected, pyramid)
+    report(f'multi {name}', exact_times, pyramid_times, exact_correct, pyramid_correct, total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--frames', help='a recording to benchmark on instead of synthetic frames')
+    parser.add_argument('--runs', type=int, default=20, help='the number of frames per search')
+    parser.add_argument('--levels', type=int, default=2, help='the number of pyramid levels')
+    args = parser.parse_args()
+
+    print(f"{'search':<24}{'exact':>13}{'pyramid':>13}{'speedup':>10}"
+          f"{'exact acc':>11}{'pyr. acc':>11}")
+    rng = np.random.default_rng(0)
+    for name in ('minimap_tl', 'minimap_br', 'elite', 'rune_buff'):
+        if args.frames:
+            frames = [(frame, None) for frame in recorded_frames(args.frames, args.runs)]
+        else:
+            frames = [synthetic_frame(rng, templates[name], 1) for _ in range(args.runs)]
+        benchmark_single(name, frames, args.levels)
+
+    for name, threshold in (('elite', 0.9), ('rune_buff', 0.9)):
+        if args.frames:
+            frames = [(frame, None) for frame in recorded_frames(args.frames, args.runs)]
+        else:
+            frames = [synthetic_frame(rng, templates[name], COPIES) for _ in range(args.runs)]
+        benchmark_multi(name, frames, threshold, args.levels)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Compares the latency, memory footprint and accuracy of the rune model's backends, including
+its quantized variants, on a labelled set of rune screenshots.
+
+Run from the root of the repository:
+    python -m benchmarks.rune_model PATH [--backends NAME ...] [--runs N]
+
+PATH is a directory of rune screenshots containing a labels.txt file. Each line of labels.txt
+holds the file name of a screenshot followed by its four arrows from left to right, such as
+    rune_001.png up left left down
+
+Each backend is measured in a fresh process so that the runtimes cannot share memory. Accuracy
+is the share of screenshots whose four arrows are all predicted correctly, and agreement is
+the share on which a backend predicts the same arrows as the float SavedModel.
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from src.detection import backends, detection
+
+try:
+    import psutil
+except ImportError:     # Memory footprints are only reported if psutil is installed
+    psutil = None
+
+
+# Name of the file in the screenshot directory that holds each screenshot's arrows
+LABELS_FILE = 'labels.txt'
+
+# Backends that are benchmarked when none are given
+DEFAULT_BACKENDS = ('tensorflow', 'tflite', 'tflite-float16', 'tflite-int8', 'onnx')
+
+
+def load_labels(path):
+    """Returns a list of (file, arrows) for every labelled screenshot in the directory PATH."""
+
+    labels = []
+    with open(os.path.join(path, LABELS_FILE)) as file:
+        for line in file:
+            parts = line.split()
+            if parts:
+                labels.append((os.path.join(path, parts[0]), parts[1:]))
+    return labels
+
+
+def resident_memory():
+    """Returns this process's resident memory in bytes, None if psutil is unavailable."""
+
+    return psutil.Process().memory_info().rss if psutil else None
+
+
+def measure(backend, files, runs):
+    """
+    Loads BACKEND and classifies every screenshot in FILES with it. Runs in its own process.
+    :param backend:     The name of the backend to measure.
+    :param files:       The paths of the screenshots to classify.
+    :param runs:        The number of times each screenshot is classified to time it.
+    :return:            A dictionary of the backend's predictions and measurements.
+    """
+
+    images = [cv2.imread(file) for file in files]
+    before = resident_memory()
+    start = time.perf_counter()
+    model = backends.load(backend)
+    detection.batch_detection(model, images[:1])      # Warm up
+    load_time = time.perf_counter() - start
+    after = resident_memory()
+
+    predictions, latencies = [], []
+    for image in images:
+        for _ in range(runs):
+            start = time.perf_counter()
+            arrows = detection.batch_detection(model, [image])[0]
+            latencies.append(time.perf_counter() - start)
+        predictions.append(arrows)
+
+    path = backends.model_path(backend)
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, names in os.walk(path) for f in names)
+    else:
+        size = os.path.getsize(path)
+    return {
+        'predictions': predictions,
+        'latencies': latencies,
+        'load_time': load_time,
+        'memory': after - before if before is not None else None,
+        'size': size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('path', help='a directory of labelled rune screenshots')
+    parser.add_argument('--backends', nargs='+', default=DEFAULT_BACKENDS,
+                        choices=sorted(backends.BACKENDS), help='the backends to compare')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='the number of times each screenshot is classified')
+    args = parser.parse_args()
+
+    labels = load_labels(args.path)
+    files = [file for file, _ in labels]
+    truth = [arrows for _, arrows in labels]
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for backend in args.backends:
+        if not os.path.exists(backends.model_path(backend)):
+            print(f"[!] Skipping '{backend}', convert it with "
+                  f"'python -m src.detection.convert {backend}'")
+            continue
+        with context.Pool(1) as pool:
+            results[backend] = pool.apply(measure, (backend, files, args.runs))
+
+    reference = results.get(backends.DEFAULT_BACKEND)
+    print(f"\n{'backend':<16}{'mean':>10}{'p95':>10}{'load':>9}{'memory':>11}{'size':>10}"
+          f"{'accuracy':>10}{'agreement':>11}")
+    for backend, result in results.items():
+        latencies = np.array(result['latencies']) * 1000
+        memory = f"{result['memory'] / 2 ** 20:.0f} MiB" if result['memory'] is not None else 'n/a'
+        correct = sum(p == t for p, t in zip(result['predictions'], truth))
+        if reference is not None:
+            agreeing = sum(p == r for p, r in zip(result['predictions'], reference['predictions']))
+            agreement = f'{100 * agreeing / len(truth):.1f}%'
+        else:
+            agreement = 'n/a'
+        print(f'{backend:<16}{latencies.mean():>7.1f} ms{np.percentile(latencies, 95):>7.1f} ms'
+              f"{result['load_time']:>7.1f} s{memory:>11}{result['size'] / 2 ** 20:>6.1f} MiB"
+              f'{100 * correct / len(truth):>9.1f}%{agreement:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,34 @@
 """The central program that ties all the modules together."""
 
+import os
 import time
 
 from dotenv import load_dotenv
 
+from src.common import config
 from src.modules.bot import Bot
 from src.modules.capture import Capture
 from src.modules.notifier import Notifier
 from src.modules.listener import Listener
 from src.modules.gui import GUI
 from src.modules.telegram_bot import TelegramBot
+from src.common.frame_sources import ReplayFrameSource
 
 load_dotenv()
 
+# Run the rune model with a lighter runtime if one is configured
+config.model_backend = os.getenv('MODEL_BACKEND') or config.model_backend
+
+# Replay recorded frames instead of capturing the game window if a recording is provided
+replay_path = os.getenv('REPLAY_PATH')
+if replay_path:
+    replay_rate = os.getenv('REPLAY_FRAME_RATE')
+    source = ReplayFrameSource(replay_path, frame_rate=float(replay_rate) if replay_rate else None)
+else:
+    source = None
+
 bot = Bot()
-capture = Capture()
+capture = Capture(source)
 notifier = Notifier()
 listener = Listener()
 telegram = TelegramBot()
@@ -31,6 +45,11 @@ capture.start()
 while not capture.ready:
     time.sleep(0.01)
 
+# Record the session to a frame archive if a path is provided
+record_path = os.getenv('RECORD_PATH')
+if record_path:
+    capture.start_recording(record_path)
+
 notifier.start()
 while not notifier.ready:
     time.sleep(0.01)
@@ -44,6 +63,9 @@ print('\n[~] Successfully initialized Auto Maple')
 gui = GUI()
 gui.start()
 
+# Finalize the session's frame archive once the GUI is closed
+capture.stop_recording()
+
 
 #pylint: disable=W0105
 """
@@ -3,7 +3,7 @@
 from src.common import config, settings, utils
 import time
 import math
-from src.routine.components import Command
+from src.routine.components import Command, predicted_pos
 from src.common.vkeys import press, key_down, key_up
 
 
@@ -83,14 +83,14 @@ class Adjust(Command):
                         while config.enabled and d_x < -1 * threshold and walk_counter < 60:
                             time.sleep(0.05)
                             walk_counter += 1
-                            d_x = self.target[0] - config.player_pos[0]
+                            d_x = self.target[0] - predicted_pos()[0]
                         key_up('left')
                     else:
                         key_down('right')
                         while config.enabled and d_x > threshold and walk_counter < 60:
                             time.sleep(0.05)
                             walk_counter += 1
-                            d_x = self.target[0] - config.player_pos[0]
+                            d_x = self.target[0] - predicted_pos()[0]
                         key_up('right')
                     counter -= 1
             else:
@@ -104,6 +104,7 @@ class Adjust(Command):
                         press(Key.JUMP, 3, down_time=0.1)
                         key_up('down')
                         time.sleep(0.05)
+                    config.player_state.wait_until_settled(0.5)
                     counter -= 1
             error = utils.distance(config.player_pos, self.target)
             toggle = not toggle
@@ -4,7 +4,7 @@ import math
 
 # pylint: disable=import-error
 from src.common import config, settings, utils
-from src.routine.components import Command, Walk
+from src.routine.components import Command, Walk, predicted_pos
 from src.common.vkeys import press, key_down, key_up
 # pylint: enable=import-error
 
@@ -100,14 +100,14 @@ class Adjust(Command):
                         while config.enabled and d_x < -1 * threshold and walk_counter < 60:
                             time.sleep(0.05)
                             walk_counter += 1
-                            d_x = self.target[0] - config.player_pos[0]
+                            d_x = self.target[0] - predicted_pos()[0]
                         key_up('left')
                     else:
                         key_down('right')
                         while config.enabled and d_x > threshold and walk_counter < 60:
                             time.sleep(0.05)
                             walk_counter += 1
-                            d_x = self.target[0] - config.player_pos[0]
+                            d_x = self.target[0] - predicted_pos()[0]
                         key_up('right')
                     counter -= 1
             else:
@@ -121,6 +121,7 @@ class Adjust(Command):
                         press(Key.JUMP, 3, down_time=0.1)
                         key_up('down')
                         time.sleep(0.05)
+                    config.player_state.wait_until_settled(0.5)
                     counter -= 1
             error = utils.distance(config.player_pos, self.target)
             toggle = not toggle
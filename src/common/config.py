@@ -13,6 +13,9 @@ RESOURCES_DIR = 'resources'
 # The player's position relative to the minimap
 player_pos = (0, 0)
 
+# A MotionState holding the player's filtered position, velocity and the time they were measured
+player_state = None
+
 # Describes whether the main bot loop is currently running or not
 enabled = False
 
@@ -22,6 +25,9 @@ stage_fright = False
 # Represents the current shortest path that the bot is taking
 path = []
 
+# The runtime that the rune model is run with, one of the backends in detection.backends
+model_backend = 'tensorflow'
+
 
 #############################
 #       Shared Modules      #
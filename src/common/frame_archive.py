@@ -0,0 +1,164 @@
+"""A memory-mapped archive format for recording and replaying raw capture sessions."""
+
+import os
+import struct
+
+import numpy as np
+
+
+# Identifies a file as a frame archive, followed by the version of its layout
+MAGIC = b'AMFA'
+VERSION = 1
+
+# Magic, version, frame height, frame width, channels and number of frames
+HEADER = struct.Struct('<4sIIIIQ')
+HEADER_SIZE = 64
+
+# File extension used for frame archives
+EXTENSION = '.frames'
+
+# Number of frames to grow the archive by whenever it runs out of space
+GROWTH = 256
+
+
+def record_dtype(height, width, channels):
+    """
+    Returns the layout of a single record in an archive of frames with the given shape.
+    :param height:      The height of each frame in pixels.
+    :param width:       The width of each frame in pixels.
+    :param channels:    The number of channels in each frame.
+    :return:            A structured numpy dtype.
+    """
+
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('window', '<i4', 4),           # Left, top, width and height of the game window
+        ('player_pos', '<f4', 2),
+        ('enabled', '?'),
+        ('frame', 'u1', (height, width, channels))
+    ])
+
+
+class FrameArchiveWriter:
+    """
+    Appends fixed-size frames and their metadata to a memory-mapped archive. Each frame is
+    copied into the archive with a single assignment, and the file grows in chunks of GROWTH
+    frames so that it does not need to be remapped on every append.
+    """
+
+    def __init__(self, path, height, width, channels=4):
+        """
+        Creates a new, empty archive at PATH for frames of the given shape.
+        :param path:        The path to write the archive to.
+        :param height:      The height of each frame in pixels.
+        :param width:       The width of each frame in pixels.
+        :param channels:    The number of channels in each frame.
+        """
+
+        self.path = path
+        self.shape = (height, width, channels)
+        self.dtype = record_dtype(height, width, channels)
+        self.count = 0
+        self.capacity = 0
+        self.records = None
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'wb') as file:
+            header = HEADER.pack(MAGIC, VERSION, height, width, channels, 0)
+            file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self._grow()
+
+    def append(self, frame, timestamp, window, player_pos, enabled):
+        """
+        Appends FRAME and its metadata to the archive.
+        :param frame:       The frame to record, which must match the archive's frame shape.
+        :param timestamp:   The time at which FRAME was captured.
+        :param window:      The (left, top, width, height) of the game window.
+        :param player_pos:  The player's position relative to the minimap.
+        :param enabled:     Whether the bot was enabled when FRAME was captured.
+        :return:            Whether FRAME was recorded.
+        """
+
+        if frame.shape != self.shape:
+            return False
+        if self.count == self.capacity:
+            self._grow()
+        record = self.records[self.count]
+        record['timestamp'] = timestamp
+        record['window'] = window
+        record['player_pos'] = player_pos
+        record['enabled'] = enabled
+        record['frame'] = frame
+        self.count += 1
+        return True
+
+    def close(self):
+        """Trims any unused space off the end of the archive and records its final length."""
+
+        if self.records is None:
+            return
+        self.records.flush()
+        self.records = None
+        with open(self.path, 'r+b') as file:
+            file.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, *self.shape, self.count))
+
+    def _grow(self):
+        """Extends the archive by GROWTH records and remaps it."""
+
+        if self.records is not None:
+            self.records.flush()
+        self.capacity += GROWTH
+        self.records = np.memmap(self.path, dtype=self.dtype, mode='r+',
+                                 offset=HEADER_SIZE, shape=(self.capacity,))
+
+
+class FrameArchive:
+    """Provides read-only random access to the records of a frame archive."""
+
+    def __init__(self, path):
+        """
+        Memory-maps the archive at PATH.
+        :param path:    The path of the archive to open.
+        """
+
+        with open(path, 'rb') as file:
+            magic, version, height, width, channels, count = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a frame archive")
+        if version != VERSION:
+            raise ValueError(f"Unsupported frame archive version {version} in '{path}'")
+
+        self.path = path
+        self.shape = (height, width, channels)
+        self.dtype = record_dtype(height, width, channels)
+
+        # An archive that was not closed properly still holds every record written before
+        # the recorder stopped, followed by unused space with a timestamp of zero
+        if count == 0:
+            count = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+            if count:
+                records = np.memmap(path, dtype=self.dtype, mode='r',
+                                    offset=HEADER_SIZE, shape=(count,))
+                count = int(np.count_nonzero(records['timestamp']))
+        self.records = np.memmap(path, dtype=self.dtype, mode='r',
+                                 offset=HEADER_SIZE, shape=(count,)) if count else []
+
+    def read(self, index):
+        """Returns the frame at INDEX, or None if INDEX is out of range."""
+
+        if 0 <= index < len(self):
+            return self.records[index]['frame']
+        return None
+
+    def release(self):
+        self.records = []
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def __len__(self):
+        return len(self.records)
@@ -0,0 +1,168 @@
+"""A collection of frame sources that Capture can take screenshots from."""
+
+import os
+import time
+
+import cv2
+
+from src.common import frame_archive # pylint: disable=import-error
+
+
+# File extensions recognized as frames when replaying a directory
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp'}
+
+
+class FrameSource:
+    """
+    Interface for anything that Capture can take screenshots from. A frame source writes
+    BGRA frames directly into the buffers of a FrameRing.
+    """
+
+    def __init__(self):
+        self.rect = None        # The (left, top, right, bottom) bounds of the source on screen
+        self.width = 0
+        self.height = 0
+
+    def grab(self, ring, region=None):
+        """
+        Copies the current frame into the next buffer of RING.
+        :param ring:    The FrameRing to write the screenshot into.
+        :param region:  The (left, top, right, bottom) bounds of the area to capture, relative
+                        to the game screen. Captures the whole screen if None.
+        :return:        The filled BGRA buffer, None if no frame could be captured.
+        """
+
+        raise NotImplementedError
+
+    def release(self):
+        """Frees any resources held by this source."""
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Replays previously recorded frames from a directory of images, a video file or a frame
+    archive, so that everything downstream of Capture can run and be timed without the game.
+    """
+
+    def __init__(self, path, frame_rate=None, loop=True):
+        """
+        Opens the recording at PATH.
+        :param path:        A directory of images (replayed in sorted order), a video file
+                            or a frame archive.
+        :param frame_rate:  The number of frames to replay per second. If None, the source
+                            advances by one frame on every full-frame grab.
+        :param loop:        Whether to start over after the last frame.
+        """
+
+        super().__init__()
+        if os.path.isdir(path):
+            self.reader = DirectoryReader(path)
+        elif os.path.splitext(path)[1] == frame_archive.EXTENSION:
+            self.reader = frame_archive.FrameArchive(path)
+        else:
+            self.reader = VideoReader(path)
+        self.frame_rate = frame_rate
+        self.loop = loop
+        self.start = None
+        self.index = -1
+        self.image = None
+
+    def grab(self, ring, region=None):
+        if not self._advance(region is None):
+            return None
+
+        if region is None:
+            region = (0, 0, self.width, self.height)
+        left, top, right, bottom = region
+        buffer = ring.next(bottom - top, right - left)
+        cropped = self.image[top:bottom, left:right]
+        if cropped.shape[2] == 4:
+            buffer[:] = cropped
+        else:
+            cv2.cvtColor(cropped, cv2.COLOR_BGR2BGRA, dst=buffer)
+        return buffer
+
+    def release(self):
+        self.reader.release()
+
+    def _advance(self, full_frame):
+        """
+        Moves to the frame that should currently be on screen.
+        :param full_frame:  Whether the grab that triggered this is a full-frame grab.
+        :return:            Whether there is a frame to show.
+        """
+
+        if self.frame_rate is None:
+            index = self.index + 1 if full_frame or self.image is None else self.index
+        else:
+            now = time.perf_counter()
+            if self.start is None:
+                self.start = now
+            index = int((now - self.start) * self.frame_rate)
+
+        if self.loop and len(self.reader) > 0:
+            index %= len(self.reader)
+        if index != self.index or self.image is None:
+            image = self.reader.read(index)
+            if image is None:
+                return False
+            self.index = index
+            self.image = image
+            self.height, self.width = image.shape[:2]
+            self.rect = (0, 0, self.width, self.height)
+        return True
+
+
+class DirectoryReader:
+    """Provides random access to a directory of images, ordered by file name."""
+
+    def __init__(self, path):
+        self.files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                            if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+
+    def read(self, index):
+        """Returns the BGR image at INDEX, or None if INDEX is out of range."""
+
+        if 0 <= index < len(self.files):
+            return cv2.imread(self.files[index], cv2.IMREAD_COLOR)
+        return None
+
+    def release(self):
+        pass
+
+    def __len__(self):
+        return len(self.files)
+
+
+class VideoReader:
+    """Provides access to the frames of a video file, reading sequentially where possible."""
+
+    def __init__(self, path):
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Unable to open recording '{path}'")
+        self.length = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0           # Index of the frame that the next read will return
+
+    def read(self, index):
+        """Returns the BGR frame at INDEX, or None if INDEX is out of range."""
+
+        if not 0 <= index < self.length:
+            return None
+        if index < self.position:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.position = index
+        while self.position < index:            # Skip frames without decoding them
+            self.video.grab()
+            self.position += 1
+        success, image = self.video.read()
+        if not success:
+            return None
+        self.position += 1
+        return image
+
+    def release(self):
+        self.video.release()
+
+    def __len__(self):
+        return self.length
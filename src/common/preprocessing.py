@@ -0,0 +1,199 @@
+"""Shared preprocessing of captured frames: a per-frame cache and colour classification."""
+
+import threading
+
+import cv2
+import numpy as np
+
+
+# Number of most recent frames whose derived images are kept
+MAX_FRAMES = 4
+
+
+class FrameCache:
+    """
+    Computes grayscale and colour class versions of captured frames at most once per frame
+    and region, keyed by the sequence number of the frame. Derived images of the whole frame
+    are reused for any region within it by slicing.
+    """
+
+    def __init__(self, max_frames=MAX_FRAMES):
+        """
+        Creates an empty FrameCache.
+        :param max_frames:  The number of most recent frames to keep derived images for.
+        """
+
+        self.max_frames = max_frames
+        self.entries = {}           # Maps frame IDs to dictionaries of derived images
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def gray(self, frame, roi=None):
+        """
+        Returns FRAME, cropped to ROI, in grayscale.
+        :param frame:   A Frame tagged with its sequence number.
+        :param roi:     The (left, top, right, bottom) region of FRAME to convert, or None.
+        :return:        A read-only grayscale image.
+        """
+
+        return self._get(frame, roi, 'gray', lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
+    def color_classes(self, frame, lut, roi=None):
+        """
+        Returns the colour classes of every pixel in FRAME, cropped to ROI, according to LUT.
+        :param frame:   A Frame tagged with its sequence number.
+        :param lut:     The ColorLUT to classify pixels with.
+        :param roi:     The (left, top, right, bottom) region of FRAME to classify, or None.
+        :return:        A read-only array of class bits, as returned by ColorLUT.classify.
+        """
+
+        def build(image):
+            return lut.classify(image, out=np.empty(image.shape[:2], dtype=np.uint8))
+
+        return self._get(frame, roi, ('classes', id(lut)), build)
+
+    def stats(self):
+        """Returns the number of cache hits and misses, and the resulting hit rate."""
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0
+        }
+
+    def _get(self, frame, roi, kind, build):
+        """
+        Returns the derived image of the given KIND, building and caching it if necessary.
+        :param frame:   A Frame tagged with its sequence number.
+        :param roi:     The (left, top, right, bottom) region of FRAME, or None.
+        :param kind:    A hashable description of the derived image.
+        :param build:   A function that computes the derived image from a crop of FRAME.
+        :return:        The derived image.
+        """
+
+        frame_id = getattr(frame, 'id', 0)
+        with self.lock:
+            derived = self.entries.get(frame_id, {})
+            image = derived.get((kind, roi))
+            if image is None and roi is not None and (kind, None) in derived:
+                left, top, right, bottom = roi
+                image = derived[(kind, None)][top:bottom, left:right]
+            if image is not None and frame_id:
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        if roi is None:
+            image = build(frame)
+        else:
+            left, top, right, bottom = roi
+            image = build(frame[top:bottom, left:right])
+        image = np.asarray(image)
+        image.flags.writeable = False
+        if not frame_id:        # Untagged images cannot be told apart, so are never cached
+            return image
+
+        with self.lock:
+            if frame_id not in self.entries:
+                self.entries[frame_id] = {}
+                while len(self.entries) > self.max_frames:
+                    del self.entries[min(self.entries)]
+            if frame_id in self.entries:
+                self.entries[frame_id][(kind, roi)] = image
+        return image
+
+
+class ColorLUT:
+    """
+    Classifies pixels into named colour classes, each defined by HSV ranges as used by
+    utils.filter_color. Every possible BGR colour is classified once when the table is built,
+    so classifying an image afterwards is a single table lookup per pixel, with no HSV
+    conversion and no full-size intermediate images.
+    """
+
+    def __init__(self, classes):
+        """
+        Builds a lookup table for up to eight colour classes.
+        :param classes:     A dictionary mapping each class name to a tuple of (lower, upper)
+                            HSV bounds.
+        """
+
+        assert len(classes) <= 8, 'ColorLUT supports at most 8 colour classes'
+        self.bits = {name: 1 << i for i, name in enumerate(classes)}
+        self.table = np.zeros(1 << 24, dtype=np.uint8)      # Indexed by B | G << 8 | R << 16
+        self.scratch = threading.local()
+
+        # Classify every colour, one 256 x 256 slice of blue and green per value of red
+        green, blue = np.mgrid[0:256, 0:256].astype(np.uint8)
+        colors = np.empty((256, 256, 3), dtype=np.uint8)
+        colors[..., 0] = blue
+        colors[..., 1] = green
+        for red in range(256):
+            colors[..., 2] = red
+            hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+            chunk = self.table[red << 16:(red + 1) << 16].reshape(256, 256)
+            for name, ranges in classes.items():
+                for lower, upper in ranges:
+                    chunk[cv2.inRange(hsv, lower, upper) > 0] |= self.bits[name]
+
+    def classify(self, image, out=None):
+        """
+        Looks up the colour classes of every pixel in IMAGE.
+        :param image:   A BGR or BGRA image.
+        :param out:     A uint8 array with IMAGE's height and width to write the result to. If
+                        None, a per-thread scratch buffer is reused, which is overwritten by
+                        the next call from the same thread.
+        :return:        An array in which bit i of each pixel is set if the pixel belongs to
+                        the i-th colour class.
+        """
+
+        height, width = image.shape[:2]
+        indices = self._buffer('indices', (height, width), np.uint32)
+
+        # Reinterpret each BGRA pixel as a little-endian integer index, dropping alpha
+        if image.shape[2] == 4 and image.flags.c_contiguous:
+            pixels = image.view(np.uint32).reshape(height, width)
+        else:
+            pixels = indices
+            bgra = indices.view(np.uint8).reshape(height, width, 4)
+            if image.shape[2] == 3:
+                cv2.cvtColor(image, cv2.COLOR_BGR2BGRA, dst=bgra)
+            else:
+                np.copyto(bgra, image)
+        np.bitwise_and(pixels, 0xFFFFFF, out=indices)
+
+        if out is None:
+            out = self._buffer('classes', (height, width))
+        np.take(self.table, indices, out=out)
+        return out
+
+    def select(self, classes, name):
+        """
+        Extracts a single class from the result of ColorLUT.classify.
+        :param classes:     The class bits returned by ColorLUT.classify.
+        :param name:        The name of the colour class to extract.
+        :return:            A mask that is nonzero wherever a pixel belongs to NAME.
+        """
+
+        return np.bitwise_and(classes, self.bits[name])
+
+    def mask(self, image, name):
+        """
+        Returns a mask of the pixels in IMAGE that belong to the colour class NAME.
+        :param image:   A BGR or BGRA image.
+        :param name:    The name of the colour class.
+        :return:        A mask that is nonzero wherever a pixel belongs to NAME.
+        """
+
+        return self.select(self.classify(image), name)
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        """Returns this thread's scratch buffer for KEY, reallocating it if SHAPE has changed."""
+
+        buffer = getattr(self.scratch, key, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+            setattr(self.scratch, key, buffer)
+        return buffer
@@ -0,0 +1,117 @@
+"""A bank of every template image used by Auto Maple, loaded and preprocessed once."""
+
+import os
+
+import cv2
+
+from src.common import utils # pylint: disable=import-error
+from src.common.preprocessing import ColorLUT # pylint: disable=import-error
+
+
+# Directory that all template images are loaded from
+ASSETS_DIR = 'assets'
+
+# A rune's symbol on the minimap
+RUNE_RANGES = (
+    ((141, 148, 245), (146, 158, 255)),
+)
+
+# Other players' symbols on the minimap
+OTHER_RANGES = (
+    ((0, 245, 215), (10, 255, 255)),
+)
+
+# Classifies minimap pixels into the colours of the icons above in a single lookup
+colors = ColorLUT({
+    'rune': RUNE_RANGES,
+    'other': OTHER_RANGES
+})
+
+
+class TemplateBank:
+    """
+    Loads, preprocesses and caches grayscale templates by name. Several templates can be
+    matched against one image at once, so that the image is only preprocessed a single time
+    no matter how many templates are searched for within it.
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def add(self, name, file, ranges=None):
+        """
+        Loads the template image FILE from the assets directory under the given NAME.
+        :param name:    The name to store the template under.
+        :param file:    The file name of the template within ASSETS_DIR.
+        :param ranges:  If provided, HSV ranges that the template is color filtered by before
+                        being converted to grayscale, as used by utils.filter_color.
+        :return:        The preprocessed template.
+        """
+
+        path = os.path.join(ASSETS_DIR, file)
+        if ranges is None:
+            template = cv2.imread(path, 0)
+        else:
+            filtered = utils.filter_color(cv2.imread(path), ranges)
+            template = cv2.cvtColor(filtered, cv2.COLOR_BGR2GRAY)
+        if template is None:
+            raise FileNotFoundError(f"Unable to load template '{path}'")
+        template.flags.writeable = False
+        self.templates[name] = template
+        return template
+
+    def match(self, image, names, threshold=0.95, top_k=None):
+        """
+        Finds every distinct match of each of the named templates within IMAGE.
+        :param image:       The image (BGR or grayscale) in which to search.
+        :param names:       The names of the templates to search for.
+        :param threshold:   The minimum percentage of a template that each result must match.
+        :param top_k:       The maximum number of results per template, or None for all of them.
+        :return:            A dictionary mapping each name to an (N, 3) array of (x, y, score)
+                            as returned by utils.multi_match_nms.
+        """
+
+        gray = utils.to_gray(image)
+        return {name: utils.multi_match_nms(gray, self.templates[name], threshold, top_k)
+                for name in names}
+
+    def best(self, image, names):
+        """
+        Finds the single best match of each of the named templates within IMAGE.
+        :param image:   The image (BGR or grayscale) in which to search.
+        :param names:   The names of the templates to search for.
+        :return:        A dictionary mapping each name to the top-left and bottom-right
+                        positions of its best match, as returned by utils.single_match.
+        """
+
+        gray = utils.to_gray(image)
+        return {name: utils.single_match(gray, self.templates[name]) for name in names}
+
+    def __getitem__(self, name):
+        return self.templates[name]
+
+    def __contains__(self, name):
+        return name in self.templates
+
+
+#################################
+#       Shared Template Bank    #
+#################################
+templates = TemplateBank()
+
+# The top-left and bottom-right corners of the minimap
+templates.add('minimap_tl', 'minimap_tl_template.png')
+templates.add('minimap_br', 'minimap_br_template.png')
+
+# The player's symbol on the minimap
+templates.add('player', 'player_template.png')
+
+# Other players' and the rune's symbols on the minimap, matched against filtered minimaps
+templates.add('rune', 'rune_template.png', ranges=RUNE_RANGES)
+templates.add('other', 'other_template.png', ranges=OTHER_RANGES)
+
+# The Elite Boss's warning sign
+templates.add('elite', 'elite_template.jpg')
+
+# The rune's buff icon
+templates.add('rune_buff', 'rune_buff_template.jpg')
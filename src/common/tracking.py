@@ -0,0 +1,337 @@
+"""A module for tracking the player's symbol on the minimap from frame to frame."""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+# The smallest distance (in pixels) around the predicted position that is searched
+MIN_SEARCH_RADIUS = 4
+
+# How many pixels to widen the search window by for each pixel per frame of velocity
+VELOCITY_MARGIN = 2
+
+# Weight given to the newest displacement when updating the estimated velocity
+VELOCITY_SMOOTHING = 0.5
+
+# Weight given to the newest sample in the running average of match cost
+COST_SMOOTHING = 0.05
+
+# Variance of the player's acceleration assumed by the constant-velocity filter,
+# in relative minimap units per second squared
+ACCELERATION_VARIANCE = 1.0
+
+# Variance of a single sub-pixel position measurement, in relative minimap units
+MEASUREMENT_VARIANCE = 4e-6
+
+# Measurements further than this from the prediction are treated as a teleport and
+# reset the filter instead of being blended in
+MAX_INNOVATION = 0.02
+
+# Number of consecutive frames the filter coasts on its prediction before the player
+# is considered to be standing still at their last known position
+MAX_MISSES = 5
+
+# Speed (in relative units per second) below which the player is considered to be settled
+SETTLED_SPEED = 0.02
+
+# Distance (in relative units) the player must move before a step is considered to have started,
+# about three times the standard deviation of a measurement
+MOVED_DISTANCE = 0.006
+
+# Minimum number of seconds to wait after a step, even if the player settles sooner
+SETTLE_DELAY = 0.03
+
+
+class PlayerTracker:
+    """
+    Finds the player's symbol on the minimap by searching a small window around its last known
+    position. The window grows with the player's recent velocity, and the whole minimap is
+    only searched when the symbol cannot be found confidently inside of the window.
+    """
+
+    def __init__(self, template, threshold=0.8):
+        """
+        Creates a new PlayerTracker that looks for TEMPLATE.
+        :param template:    The grayscale template of the player's symbol.
+        :param threshold:   The minimum normalized correlation of a valid match.
+        """
+
+        self.template = template
+        self.threshold = threshold
+        self.position = None            # Center of the last match in absolute coordinates
+        self.velocity = (0.0, 0.0)      # Average displacement in pixels per frame
+
+        # Time taken (in seconds) to locate the player, and how often each search was used
+        self.cost = {'last': 0, 'average': 0}
+        self.searches = {'local': 0, 'full': 0}
+
+    def reset(self):
+        """Forgets the player's last known position, forcing the next search to be a full one."""
+
+        self.position = None
+        self.velocity = (0.0, 0.0)
+
+    def locate(self, minimap):
+        """
+        Finds the player within MINIMAP.
+        :param minimap:     The BGR(A) image of the minimap.
+        :return:            The center of the player's symbol in absolute coordinates,
+                            or None if the player could not be found.
+        """
+
+        start = time.perf_counter()
+        match = None
+        if self.position is not None:
+            match = self._local_search(minimap)
+            if match is not None:
+                self.searches['local'] += 1
+        if match is None:
+            match = self._search(minimap, 0, 0)
+            self.searches['full'] += 1
+
+        if match is None:
+            self.reset()
+        else:
+            if self.position is not None:
+                d_x = match[0] - self.position[0]
+                d_y = match[1] - self.position[1]
+                self.velocity = (
+                    self.velocity[0] + VELOCITY_SMOOTHING * (d_x - self.velocity[0]),
+                    self.velocity[1] + VELOCITY_SMOOTHING * (d_y - self.velocity[1])
+                )
+            self.position = match
+
+        elapsed = time.perf_counter() - start
+        self.cost['last'] = elapsed
+        if self.cost['average'] == 0:
+            self.cost['average'] = elapsed
+        else:
+            self.cost['average'] += COST_SMOOTHING * (elapsed - self.cost['average'])
+        return match
+
+    def _local_search(self, minimap):
+        """
+        Searches a window around the player's predicted position.
+        :param minimap:     The BGR(A) image of the minimap.
+        :return:            The center of the match in absolute coordinates, None if not found.
+        """
+
+        t_height, t_width = self.template.shape
+        height, width = minimap.shape[:2]
+        x = self.position[0] + self.velocity[0]
+        y = self.position[1] + self.velocity[1]
+        radius = MIN_SEARCH_RADIUS + VELOCITY_MARGIN * max(abs(self.velocity[0]),
+                                                           abs(self.velocity[1]))
+        x0 = max(0, int(x - radius - t_width / 2))
+        y0 = max(0, int(y - radius - t_height / 2))
+        x1 = min(width, int(x + radius + t_width / 2) + 1)
+        y1 = min(height, int(y + radius + t_height / 2) + 1)
+        return self._search(minimap[y0:y1, x0:x1], x0, y0)
+
+    def _search(self, image, x0, y0):
+        """
+        Finds the best match for the player's symbol within IMAGE.
+        :param image:   The BGR(A) image to search.
+        :param x0:      The horizontal offset of IMAGE within the minimap.
+        :param y0:      The vertical offset of IMAGE within the minimap.
+        :return:        The center of the match in absolute coordinates, None if not found.
+        """
+
+        t_height, t_width = self.template.shape
+        if t_height > image.shape[0] or t_width > image.shape[1]:
+            return None
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        result = cv2.matchTemplate(gray, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, top_left = cv2.minMaxLoc(result)
+        if not np.isfinite(score) or score < self.threshold:
+            return None
+        d_x, d_y = refine_peak(result, top_left)
+        return (
+            x0 + top_left[0] + d_x + t_width / 2,
+            y0 + top_left[1] + d_y + t_height / 2
+        )
+
+
+class MotionState:
+    """
+    Estimates the player's position and velocity on the minimap using a constant-velocity
+    Kalman filter over timestamped measurements. Short runs of missed detections are smoothed
+    over using the filter's prediction, and large jumps such as teleports reset the filter.
+    """
+
+    def __init__(self):
+        """Creates a new MotionState with no measurements."""
+
+        self.updated = threading.Condition()
+        self.state = None               # Rows are position and velocity, columns are x and y
+        self.covariance = None          # Shared by both axes, which are filtered identically
+        self.timestamp = 0
+        self.misses = 0
+
+    @property
+    def position(self):
+        """The filtered position of the player, or None if it has never been measured."""
+
+        state = self.state
+        return None if state is None else (float(state[0, 0]), float(state[0, 1]))
+
+    @property
+    def velocity(self):
+        """The filtered velocity of the player in relative units per second."""
+
+        state = self.state
+        return (0.0, 0.0) if state is None else (float(state[1, 0]), float(state[1, 1]))
+
+    def reset(self, position=None, timestamp=0):
+        """
+        Discards the filter's history.
+        :param position:    The position to restart from, or None to forget the player.
+        :param timestamp:   The time (from time.perf_counter) at which POSITION was measured.
+        :return:            None
+        """
+
+        with self.updated:
+            if position is None:
+                self.state = None
+            else:
+                self.state = np.array([position, (0.0, 0.0)], dtype=np.float64)
+            self.covariance = np.diag((MEASUREMENT_VARIANCE, 1.0))
+            self.timestamp = timestamp
+            self.misses = 0
+            self.updated.notify_all()
+
+    def update(self, position, timestamp):
+        """
+        Blends a new measurement of the player's position into the filter.
+        :param position:    The measured position in relative coordinates.
+        :param timestamp:   The time (from time.perf_counter) at which POSITION was captured.
+        :return:            None
+        """
+
+        if self.state is None:
+            self.reset(position, timestamp)
+            return
+
+        with self.updated:
+            self._predict(timestamp)
+            innovation = np.asarray(position, dtype=np.float64) - self.state[0]
+            if np.abs(innovation).max() > MAX_INNOVATION:
+                self.state = np.array([position, (0.0, 0.0)], dtype=np.float64)
+                self.covariance = np.diag((MEASUREMENT_VARIANCE, 1.0))
+            else:
+                gain = self.covariance[:, 0] / (self.covariance[0, 0] + MEASUREMENT_VARIANCE)
+                self.state += np.outer(gain, innovation)
+                self.covariance -= np.outer(gain, self.covariance[0])
+            self.misses = 0
+            self.updated.notify_all()
+
+    def miss(self, timestamp):
+        """
+        Advances the filter through a frame in which the player could not be found.
+        :param timestamp:   The time (from time.perf_counter) at which the frame was captured.
+        :return:            None
+        """
+
+        if self.state is None:
+            return
+
+        with self.updated:
+            self.misses += 1
+            if self.misses <= MAX_MISSES:
+                self._predict(timestamp)
+            else:
+                self.state[1] = 0.0
+                self.timestamp = timestamp
+            self.updated.notify_all()
+
+    def predict(self, timestamp=None):
+        """
+        Extrapolates the player's position to TIMESTAMP assuming constant velocity.
+        :param timestamp:   The time (from time.perf_counter) to predict for, defaults to now.
+        :return:            The predicted position, or None if the player has never been measured.
+        """
+
+        state = self.state
+        if state is None:
+            return None
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        d_t = max(0.0, timestamp - self.timestamp)
+        return (float(state[0, 0] + state[1, 0] * d_t),
+                float(state[0, 1] + state[1, 1] * d_t))
+
+    def wait_until_settled(self, timeout, speed=SETTLED_SPEED, min_delay=SETTLE_DELAY):
+        """
+        Blocks until the player has started moving and a later measurement shows them moving
+        slower than SPEED again, so that callers do not have to sleep for a fixed amount of
+        time after a step. The player has started moving once their speed reaches SPEED or
+        their position changes by more than MOVED_DISTANCE, which also covers teleports.
+        :param timeout:     The maximum number of seconds to wait.
+        :param speed:       The speed (in relative units per second) considered to be settled.
+        :param min_delay:   The minimum number of seconds to wait.
+        :return:            Whether the player settled before TIMEOUT expired.
+        """
+
+        start = time.perf_counter()
+        origin = self.position
+        moved_at = None
+
+        def settled():
+            nonlocal moved_at
+            if self.state is None or self.timestamp <= start:
+                return False
+            current_speed = float(np.hypot(*self.state[1]))
+            if moved_at is None:
+                position = self.state[0]
+                if origin is None or current_speed >= speed or \
+                        float(np.hypot(position[0] - origin[0], position[1] - origin[1])) > MOVED_DISTANCE:
+                    moved_at = self.timestamp
+                return False
+            return self.timestamp > moved_at and current_speed < speed
+
+        with self.updated:
+            result = self.updated.wait_for(settled, timeout)
+        remaining = min(min_delay, timeout) - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        return result
+
+    def _predict(self, timestamp):
+        """Advances the filter's state and covariance to TIMESTAMP."""
+
+        d_t = max(0.0, timestamp - self.timestamp)
+        transition = np.array(((1.0, d_t), (0.0, 1.0)))
+        noise = ACCELERATION_VARIANCE * np.array(((d_t ** 4 / 4, d_t ** 3 / 2),
+                                                  (d_t ** 3 / 2, d_t ** 2)))
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+        self.timestamp = timestamp
+
+
+#################################
+#       Helper Functions        #
+#################################
+def refine_peak(result, peak):
+    """
+    Estimates the sub-pixel offset of a peak in a template matching result by fitting a
+    parabola through the peak and its two neighbours along each axis.
+    :param result:  The result of cv2.matchTemplate.
+    :param peak:    The (x, y) location of the highest value in RESULT.
+    :return:        The (x, y) offset of the true peak from PEAK, each within [-0.5, 0.5].
+    """
+
+    x, y = peak
+    height, width = result.shape
+
+    def offset(before, center, after):
+        curvature = before - 2 * center + after
+        if curvature >= 0:
+            return 0.0
+        return float(np.clip((before - after) / (2 * curvature), -0.5, 0.5))
+
+    d_x = offset(result[y, x - 1], result[y, x], result[y, x + 1]) if 0 < x < width - 1 else 0.0
+    d_y = offset(result[y - 1, x], result[y, x], result[y + 1, x]) if 0 < y < height - 1 else 0.0
+    return d_x, d_y
@@ -11,6 +11,15 @@ import numpy as np
 from src.common import config, settings #pylint: disable=import-error
 
 
+# Templates are not downscaled for coarse searches past this size (in pixels)
+PYRAMID_MIN_SIZE = 8
+
+# How much lower the coarse search threshold is than the final threshold
+PYRAMID_SLACK = 0.15
+
+# Number of coarse candidates refined at full resolution when looking for a single best match
+PYRAMID_CANDIDATES = 5
+
 
 def run_if_enabled(function):
     """
@@ -75,15 +84,27 @@ def separate_args(arguments):
     return args, kwargs
 
 
+def to_gray(image):
+    """
+    Converts IMAGE to grayscale unless it already is.
+    :param image:   A BGR(A) or grayscale image.
+    :return:        IMAGE in grayscale.
+    """
+
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
 def single_match(frame, template):
     """
     Finds the best match within FRAME.
-    :param frame:       The image in which to search for TEMPLATE.
+    :param frame:       The image (BGR or grayscale) in which to search for TEMPLATE.
     :param template:    The template to match with.
     :return:            The top-left and bottom-right positions of the best match.
     """
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = to_gray(frame)
     result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF)
     _, _, _, top_left = cv2.minMaxLoc(result)
     w, h = template.shape[::-1]
@@ -93,7 +114,7 @@ def single_match(frame, template):
 def multi_match(frame, template, threshold=0.95):
     """
     Finds all matches in FRAME that are similar to TEMPLATE by at least THRESHOLD.
-    :param frame:       The image in which to search.
+    :param frame:       The image (BGR or grayscale) in which to search.
     :param template:    The template to match with.
     :param threshold:   The minimum percentage of TEMPLATE that each result must match.
     :return:            An array of matches that exceed THRESHOLD.
@@ -101,7 +122,7 @@ def multi_match(frame, template, threshold=0.95):
 
     if template.shape[0] > frame.shape[0] or template.shape[1] > frame.shape[1]:
         return []
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = to_gray(frame)
     result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
     locations = np.where(result >= threshold)
     locations = list(zip(*locations[::-1]))
@@ -112,6 +133,242 @@ def multi_match(frame, template, threshold=0.95):
         results.append((x, y))
     return results
 
+def multi_match_nms(frame, template, threshold=0.95, top_k=None):
+    """
+    Finds every distinct object in FRAME that is similar to TEMPLATE by at least THRESHOLD.
+    Unlike multi_match, which returns every pixel above THRESHOLD, only the peak of each
+    object is kept by suppressing weaker matches that overlap a stronger one.
+    :param frame:       The image (BGR or grayscale) in which to search.
+    :param template:    The template to match with.
+    :param threshold:   The minimum percentage of TEMPLATE that each result must match.
+    :param top_k:       The maximum number of results to return, or None for all of them.
+    :return:            An (N, 3) array of the center and score (x, y, score) of each match,
+                        sorted from best to worst.
+    """
+
+    if template.shape[0] > frame.shape[0] or template.shape[1] > frame.shape[1]:
+        return np.empty((0, 3), dtype=np.float32)
+    gray = to_gray(frame)
+    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+    height, width = template.shape
+    xs, ys, scores = find_peaks(result, threshold, width, height)
+    matches = np.stack((xs + width / 2, ys + height / 2, scores), axis=1)
+    if top_k is not None:
+        matches = matches[:top_k]
+    return matches.astype(np.float32)
+
+
+def pyramid_single_match(frame, template, levels=2):
+    """
+    Finds the best match within FRAME by first searching a downscaled copy of FRAME and then
+    only refining the most promising candidates at full resolution. Much faster than
+    single_match on large frames, at the cost of possibly missing very thin features.
+    :param frame:       The image (BGR or grayscale) in which to search for TEMPLATE.
+    :param template:    The template to match with.
+    :param levels:      The number of times to halve FRAME and TEMPLATE for the coarse search.
+    :return:            The top-left and bottom-right positions of the best match.
+    """
+
+    levels = pyramid_depth(template, levels)
+    if levels == 0:
+        return single_match(frame, template)
+    gray = to_gray(frame)
+    height, width = template.shape
+    best_score, top_left = -np.inf, (0, 0)
+    for x, y in pyramid_candidates(gray, template, levels, -np.inf, PYRAMID_CANDIDATES):
+        score, location = refine_match(gray, template, x, y, levels)
+        if score > best_score:
+            best_score, top_left = score, location
+    return top_left, (top_left[0] + width, top_left[1] + height)
+
+
+def pyramid_multi_match(frame, template, threshold=0.95, levels=1, top_k=None):
+    """
+    Finds every distinct object in FRAME that is similar to TEMPLATE by at least THRESHOLD,
+    like multi_match_nms, but searches a downscaled copy of FRAME first and only refines the
+    neighbourhoods of candidates at full resolution.
+    :param frame:       The image (BGR or grayscale) in which to search.
+    :param template:    The template to match with.
+    :param threshold:   The minimum percentage of TEMPLATE that each result must match.
+    :param levels:      The number of times to halve FRAME and TEMPLATE for the coarse search.
+    :param top_k:       The maximum number of results to return, or None for all of them.
+    :return:            An (N, 3) array of the center and score (x, y, score) of each match,
+                        sorted from best to worst.
+    """
+
+    levels = pyramid_depth(template, levels)
+    if levels == 0:
+        return multi_match_nms(frame, template, threshold, top_k)
+    if template.shape[0] > frame.shape[0] or template.shape[1] > frame.shape[1]:
+        return np.empty((0, 3), dtype=np.float32)
+    gray = to_gray(frame)
+    height, width = template.shape
+    refined = []
+    for x, y in pyramid_candidates(gray, template, levels, threshold - PYRAMID_SLACK):
+        score, location = refine_match(gray, template, x, y, levels)
+        if score >= threshold:
+            refined.append((location[0], location[1], score))
+    if not refined:
+        return np.empty((0, 3), dtype=np.float32)
+
+    refined = np.array(refined, dtype=np.float64)
+    refined = refined[np.argsort(-refined[:, 2], kind='stable')]
+    keep = suppress_overlaps(refined[:, 0], refined[:, 1], width, height)
+    refined = refined[keep]
+    matches = np.stack((refined[:, 0] + width / 2, refined[:, 1] + height / 2, refined[:, 2]),
+                       axis=1)
+    if top_k is not None:
+        matches = matches[:top_k]
+    return matches.astype(np.float32)
+
+
+def pyramid_candidates(gray, template, levels, threshold, max_candidates=None):
+    """
+    Searches for TEMPLATE in a copy of GRAY that has been halved LEVELS times.
+    :param gray:            The grayscale image in which to search.
+    :param template:        The grayscale template to match with.
+    :param levels:          The number of pyramid levels to go down.
+    :param threshold:       The minimum normalized correlation of a candidate.
+    :param max_candidates:  The maximum number of candidates to return, or None for all.
+    :return:                A list of the estimated full-resolution top-left corners of
+                            each candidate, from best to worst.
+    """
+
+    for _ in range(levels):
+        gray = cv2.pyrDown(gray)
+        template = cv2.pyrDown(template)
+    if template.shape[0] > gray.shape[0] or template.shape[1] > gray.shape[1]:
+        return []
+
+    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+    height, width = template.shape
+    if max_candidates is None:
+        xs, ys, _ = find_peaks(result, threshold, width, height)
+        return [(int(x) << levels, int(y) << levels) for x, y in zip(xs, ys)]
+
+    # Repeatedly take the best remaining peak and blank out its neighbourhood
+    candidates = []
+    while len(candidates) < max_candidates:
+        _, score, _, (x, y) = cv2.minMaxLoc(result)
+        if not np.isfinite(score) or score < threshold:
+            break
+        candidates.append((x << levels, y << levels))
+        result[max(0, y - height + 1):y + height, max(0, x - width + 1):x + width] = -np.inf
+    return candidates
+
+
+def pyramid_depth(template, levels):
+    """
+    Returns the number of pyramid levels, up to LEVELS, that TEMPLATE can be halved
+    without becoming smaller than PYRAMID_MIN_SIZE.
+    """
+
+    while levels > 0 and min(template.shape) >> levels < PYRAMID_MIN_SIZE:
+        levels -= 1
+    return levels
+
+
+def refine_match(gray, template, x, y, levels):
+    """
+    Searches for TEMPLATE at full resolution in the neighbourhood of a coarse candidate.
+    :param gray:        The grayscale image in which to search.
+    :param template:    The grayscale template to match with.
+    :param x:           The estimated x-position of the candidate's top-left corner.
+    :param y:           The estimated y-position of the candidate's top-left corner.
+    :param levels:      The number of pyramid levels that the candidate was found at.
+    :return:            The normalized correlation and top-left corner of the best match.
+    """
+
+    radius = (1 << levels) + 1
+    height, width = template.shape
+    x0, y0 = max(0, x - radius), max(0, y - radius)
+    x1 = min(gray.shape[1], x + width + radius)
+    y1 = min(gray.shape[0], y + height + radius)
+    if x1 - x0 < width or y1 - y0 < height:
+        return -np.inf, (x, y)
+    result = cv2.matchTemplate(gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, location = cv2.minMaxLoc(result)
+    return score, (x0 + location[0], y0 + location[1])
+
+
+def find_peaks(result, threshold, width, height):
+    """
+    Extracts the distinct peaks of a template matching result.
+    :param result:      The result of cv2.matchTemplate using a normalized method.
+    :param threshold:   The minimum value of a peak.
+    :param width:       The width of the template, used as the size of a peak's neighbourhood.
+    :param height:      The height of the template, used as the size of a peak's neighbourhood.
+    :return:            The x-positions, y-positions and values of each peak, from best to worst.
+    """
+
+    # Keep only the local maxima of RESULT within a template-sized neighbourhood
+    kernel = np.ones((height, width), dtype=np.uint8)
+    peaks = (result >= threshold) & (result >= cv2.dilate(result, kernel))
+    ys, xs = np.nonzero(peaks)
+    scores = result[ys, xs]
+    order = np.argsort(-scores, kind='stable')
+    xs, ys, scores = xs[order], ys[order], scores[order]
+
+    # Flat peaks can leave several maxima for one object, keep the first of each
+    keep = suppress_overlaps(xs, ys, width, height)
+    return xs[keep], ys[keep], scores[keep]
+
+
+def suppress_overlaps(xs, ys, width, height):
+    """
+    Greedily keeps each position that does not overlap an earlier kept position.
+    :param xs:      The x-positions, sorted from most to least important.
+    :param ys:      The y-positions, in the same order as XS.
+    :param width:   The width of the box at each position.
+    :param height:  The height of the box at each position.
+    :return:        A boolean mask of the positions to keep.
+    """
+
+    keep = np.ones(len(xs), dtype=bool)
+    for i in range(len(xs)):
+        if keep[i]:
+            overlap = (np.abs(xs[i + 1:] - xs[i]) < width) & (np.abs(ys[i + 1:] - ys[i]) < height)
+            keep[i + 1:] &= ~overlap
+    return keep
+
+
+def find_blobs(mask, min_area=1, max_area=None):
+    """
+    Finds the connected blobs of nonzero pixels in MASK whose areas are within the given bounds.
+    :param mask:        A single-channel mask, such as one returned by cv2.inRange.
+    :param min_area:    The minimum number of pixels in a blob.
+    :param max_area:    The maximum number of pixels in a blob, or None for no maximum.
+    :return:            An (N, 3) array of the centroid and area (x, y, area) of each blob,
+                        sorted from largest to smallest.
+    """
+
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]         # Label 0 is the background
+    valid = areas >= min_area
+    if max_area is not None:
+        valid &= areas <= max_area
+    blobs = np.column_stack((centroids[1:][valid], areas[valid])).astype(np.float32)
+    return blobs[np.argsort(-blobs[:, 2], kind='stable')]
+
+
+def match_score(frame, template, top_left):
+    """
+    Measures how well TEMPLATE matches FRAME when placed exactly at TOP_LEFT, without
+    searching the rest of FRAME.
+    :param frame:       The image (BGR or grayscale) to check.
+    :param template:    The template to match with.
+    :param top_left:    The (x, y) position in FRAME of TEMPLATE's top-left corner.
+    :return:            The normalized correlation of the match, 0 if TEMPLATE does not fit.
+    """
+
+    x, y = top_left
+    height, width = template.shape
+    if x < 0 or y < 0 or y + height > frame.shape[0] or x + width > frame.shape[1]:
+        return 0
+    gray = to_gray(frame[y:y + height, x:x + width])
+    score = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)[0, 0]
+    return score if np.isfinite(score) else 0
+
 def convert_to_relative(point, frame):
     """
     Converts POINT into relative coordinates in the range [0, 1] based on FRAME.
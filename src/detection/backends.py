@@ -0,0 +1,174 @@
+"""
+Interchangeable runtimes for the rune model. Every backend takes a batch of images as a
+numpy array and returns the model's outputs as a dictionary of numpy arrays keyed by the
+names in the SavedModel's serving signature, so post-processing is identical between them.
+Each runtime is only imported when a model is loaded with it.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+
+# Directory that the rune model and its converted variants are stored in
+MODEL_DIR = os.path.join('assets', 'models', 'rune_model_rnn_grayed')
+
+# Where each backend's model is stored within MODEL_DIR. The quantized TFLite variants store
+# their weights as float16 or int8 to trade a little accuracy for speed and memory on CPUs.
+MODEL_FILES = {
+    'tensorflow': 'saved_model',
+    'tensorflow-batched': 'saved_model_batched',
+    'tflite': 'model.tflite',
+    'tflite-float16': 'model_float16.tflite',
+    'tflite-int8': 'model_int8.tflite',
+    'onnx': 'model.onnx'
+}
+
+# Backend used when none is configured
+DEFAULT_BACKEND = 'tensorflow'
+
+# Names of the outputs of TFLite_Detection_PostProcess, which the converted TFLite model's
+# signature lists in this order as output_0 to output_3
+TFLITE_OUTPUTS = ('detection_boxes', 'detection_classes', 'detection_scores', 'num_detections')
+
+# TFLite_Detection_PostProcess numbers classes from 0, while the SavedModel numbers them from 1
+LABEL_OFFSET = 1
+
+
+class SavedModelBackend:
+    """
+    Runs a SavedModel with the full TensorFlow runtime. The shipped SavedModel was exported
+    with the Object Detection API, which fixes its input at one image per call, so only the
+    tensorflow-batched variant made by src.detection.convert runs several images per call.
+    """
+
+    def __init__(self, path):
+        import tensorflow as tf     # pylint: disable=import-outside-toplevel
+
+        self.tf = tf
+        self.model = tf.saved_model.load(path)
+        self.model_fn = self.model.signatures['serving_default']
+
+        # Exported detection models often only accept a fixed number of images per call,
+        # in which case run_inference splits every batch into calls of that size
+        specs = list(self.model_fn.structured_input_signature[1].values())
+        self.batch_size = specs[0].shape[0] if specs and specs[0].shape.rank else None
+
+    def __call__(self, batch):
+        output_dict = self.model_fn(self.tf.convert_to_tensor(batch))
+        return {key: value.numpy() for key, value in output_dict.items()}
+
+
+class TFLiteBackend:
+    """
+    Runs a TensorFlow Lite model converted by src.detection.convert, using tflite_runtime if it
+    is installed. The TFLite graph ends in the TFLite_Detection_PostProcess op and leaves out
+    the SavedModel's resizing and normalization, so those are done here instead.
+    """
+
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter  # pylint: disable=import-outside-toplevel
+            runtime = 'tflite_runtime'
+        except ImportError:
+            print(' !  tflite_runtime is not installed, running the TFLite model with TensorFlow')
+            import tensorflow as tf                             # pylint: disable=import-outside-toplevel
+            Interpreter = tf.lite.Interpreter
+            runtime = 'tensorflow'
+
+        try:
+            self.interpreter = Interpreter(model_path=path, num_threads=os.cpu_count())
+            self.interpreter.allocate_tensors()
+        except (RuntimeError, ValueError) as e:
+            if 'Flex' in str(e) or 'TensorFlow ops' in str(e):
+                raise RuntimeError(f"'{path}' uses TensorFlow ops that {runtime} cannot run, "
+                                   f"convert it again with 'python -m src.detection.convert' "
+                                   f"to only use TFLite builtin ops") from e
+            raise
+        self.runner = self.interpreter.get_signature_runner('serving_default')
+
+        inputs = self.runner.get_input_details()
+        self.input_name = next(iter(inputs))
+        details = inputs[self.input_name]
+        shape = details.get('shape_signature', details['shape'])
+        self.batch_size = int(shape[0]) if shape[0] > 0 else None
+        self.height, self.width = int(details['shape'][1]), int(details['shape'][2])
+        self.output_names = sorted(self.runner.get_output_details())
+
+    def __call__(self, batch):
+        outputs = self.runner(**{self.input_name: ssd_input(batch, self.height, self.width)})
+        result = {key: np.array(outputs[name])
+                  for key, name in zip(TFLITE_OUTPUTS, self.output_names)}
+        result['detection_classes'] += LABEL_OFFSET
+        return result
+
+
+class ONNXBackend:
+    """Runs a converted ONNX model with ONNX Runtime."""
+
+    def __init__(self, path):
+        import onnxruntime          # pylint: disable=import-outside-toplevel
+
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        shape = self.session.get_inputs()[0].shape
+        self.batch_size = shape[0] if isinstance(shape[0], int) else None
+
+    def __call__(self, batch):
+        outputs = self.session.run(self.output_names, {self.input_name: batch})
+        return dict(zip(self.output_names, outputs))
+
+
+# Maps the name of each backend to the class that runs it
+BACKENDS = {
+    'tensorflow': SavedModelBackend,
+    'tensorflow-batched': SavedModelBackend,
+    'tflite': TFLiteBackend,
+    'tflite-float16': TFLiteBackend,
+    'tflite-int8': TFLiteBackend,
+    'onnx': ONNXBackend
+}
+
+
+def ssd_input(images, height, width):
+    """
+    Prepares images the way the SavedModel does internally before running its network.
+    :param images:  A sequence of BGR images.
+    :param height:  The height of the network's input.
+    :param width:   The width of the network's input.
+    :return:        A float32 batch resized to (HEIGHT, WIDTH) and scaled to [-1, 1].
+    """
+
+    resized = np.stack([cv2.resize(image, (width, height)) for image in images])
+    return resized.astype(np.float32) * (2 / 255) - 1
+
+
+def model_path(backend, model_dir=MODEL_DIR):
+    """
+    Returns where the model for BACKEND is stored.
+    :param backend:     The name of the backend.
+    :param model_dir:   The directory that the rune model is stored in.
+    :return:            The path to the model file or directory.
+    """
+
+    if backend not in MODEL_FILES:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of "
+                         f"{', '.join(MODEL_FILES)}")
+    return os.path.join(model_dir, MODEL_FILES[backend])
+
+
+def load(backend=DEFAULT_BACKEND, model_dir=MODEL_DIR):
+    """
+    Loads the rune model with the given BACKEND.
+    :param backend:     The name of the backend to run the model with.
+    :param model_dir:   The directory that the rune model is stored in.
+    :return:            A callable backend object.
+    """
+
+    path = model_path(backend, model_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No '{backend}' rune model at '{path}', "
+                                f"convert one with 'python -m src.detection.convert {backend}'")
+    return BACKENDS[backend](path)
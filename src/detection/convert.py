@@ -0,0 +1,212 @@
+"""
+Converts the rune model's SavedModel into the lightweight formats listed in backends.MODEL_FILES,
+so that it can be run without the full TensorFlow runtime. Requires TensorFlow, plus the
+TensorFlow 2 Object Detection API for TFLite and tensorflow-batched conversions and tf2onnx for
+ONNX conversions. Select the converted model by setting MODEL_BACKEND in .env.
+
+The shipped SavedModel only accepts one image per call. tensorflow-batched re-exports it with
+a dynamic batch size, so that run_inference classifies all queued crops in a single call.
+
+Run from the root of the repository:
+    python -m src.detection.convert BACKEND [--check IMAGE] [--calibration PATH]
+
+The tflite-float16 and tflite-int8 backends are quantized. By default tflite-int8 only
+quantizes weights. If --calibration points to a directory of rune screenshots, activations
+are quantized as well, using the screenshots to estimate their ranges.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from functools import partial
+
+import cv2
+import numpy as np
+
+from src.detection import backends, detection
+
+
+# ONNX operator set that the model is exported with
+ONNX_OPSET = 13
+
+# Maximum number of screenshots used to calibrate the ranges of int8 activations
+CALIBRATION_SAMPLES = 100
+
+# Number of detections kept by TFLite_Detection_PostProcess, matching the SavedModel's
+# max_total_detections
+MAX_DETECTIONS = 100
+
+
+def export_tflite_graph(output_dir):
+    """
+    Re-exports the rune model from its checkpoint into a SavedModel that ends in the
+    TFLite_Detection_PostProcess op, using the TensorFlow 2 Object Detection API.
+    :param output_dir:  The directory to write the intermediate SavedModel to.
+    :return:            The path of the intermediate SavedModel.
+    """
+
+    subprocess.run([sys.executable, '-m', 'object_detection.export_tflite_graph_tf2',
+                    '--pipeline_config_path', os.path.join(backends.MODEL_DIR, 'pipeline.config'),
+                    '--trained_checkpoint_dir', os.path.join(backends.MODEL_DIR, 'checkpoint'),
+                    '--output_directory', output_dir,
+                    '--max_detections', str(MAX_DETECTIONS)], check=True)
+    return os.path.join(output_dir, 'saved_model')
+
+
+def convert_tflite(saved_model, output, quantization=None, calibration=None):
+    """
+    Converts the rune model into a TensorFlow Lite model at OUTPUT that only uses TFLite
+    builtin ops, so that it runs under tflite_runtime without the Flex delegate. The model is
+    re-exported from its checkpoint with the Object Detection API's TFLite export path,
+    because the SavedModel's detection post-processing cannot be expressed in builtin ops.
+    :param saved_model:     Unused, the model is re-exported from its checkpoint instead.
+    :param output:          The path to save the converted model to.
+    :param quantization:    None, 'float16' or 'int8'.
+    :param calibration:     A directory of rune screenshots used to quantize int8 activations.
+    :return:                None
+    """
+
+    import tensorflow as tf     # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        exported = export_tflite_graph(output_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(exported)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+        if quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == 'int8' and calibration:
+            files = sorted(os.listdir(calibration))[:CALIBRATION_SAMPLES]
+            spec = tf.saved_model.load(exported).signatures['serving_default']
+            _, height, width, _ = next(iter(spec.structured_input_signature[1].values())).shape
+
+            def representative_dataset():
+                for file in files:
+                    image = cv2.imread(os.path.join(calibration, file))
+                    if image is not None:
+                        yield [backends.ssd_input([detection.crop_rune(image)], height, width)]
+
+            converter.representative_dataset = representative_dataset
+
+        try:
+            model = converter.convert()
+        except Exception as e:      # pylint: disable=broad-except
+            raise RuntimeError('The rune model cannot be converted with TFLite builtin ops '
+                               'only, so it would need the Flex delegate, which '
+                               'tflite_runtime does not provide') from e
+    with open(output, 'wb') as file:
+        file.write(model)
+
+
+def convert_batched(saved_model, output, **_):
+    """
+    Re-exports the rune model from its checkpoint into a SavedModel at OUTPUT whose serving
+    signature accepts any number of images per call. The Object Detection API's exporter fixes
+    the batch size of SAVED_MODEL at 1, so run_inference cannot batch crops with it.
+    :param saved_model:     Unused, the model is re-exported from its checkpoint instead.
+    :param output:          The directory to save the batched SavedModel to.
+    :return:                None
+    """
+
+    import tensorflow as tf     # pylint: disable=import-outside-toplevel
+    from object_detection.builders import model_builder     # pylint: disable=import-outside-toplevel
+    from object_detection.utils import config_util          # pylint: disable=import-outside-toplevel
+
+    configs = config_util.get_configs_from_pipeline_file(
+        os.path.join(backends.MODEL_DIR, 'pipeline.config'))
+    model = model_builder.build(model_config=configs['model'], is_training=False)
+    checkpoint = tf.train.Checkpoint(model=model)
+    checkpoint.restore(tf.train.latest_checkpoint(
+        os.path.join(backends.MODEL_DIR, 'checkpoint'))).expect_partial()
+
+    @tf.function(input_signature=[tf.TensorSpec((None, None, None, 3), tf.uint8, 'input_tensor')])
+    def serve(images):
+        preprocessed, shapes = model.preprocess(tf.cast(images, tf.float32))
+        detections = model.postprocess(model.predict(preprocessed, shapes), shapes)
+        detections['detection_classes'] += backends.LABEL_OFFSET
+        return detections
+
+    module = tf.Module()
+    module.model = model
+    tf.saved_model.save(module, output, signatures={'serving_default': serve})
+
+
+def convert_onnx(saved_model, output, **_):
+    """Converts the SavedModel at SAVED_MODEL into an ONNX model at OUTPUT using tf2onnx."""
+
+    subprocess.run([sys.executable, '-m', 'tf2onnx.convert',
+                    '--saved-model', saved_model,
+                    '--signature_def', 'serving_default',
+                    '--opset', str(ONNX_OPSET),
+                    '--output', output], check=True)
+
+
+# Maps each backend to the function that converts the SavedModel into its format
+CONVERTERS = {
+    'tensorflow-batched': convert_batched,
+    'tflite': convert_tflite,
+    'tflite-float16': partial(convert_tflite, quantization='float16'),
+    'tflite-int8': partial(convert_tflite, quantization='int8'),
+    'onnx': convert_onnx
+}
+
+
+def compare(backend, image):
+    """
+    Runs both the SavedModel and the converted model on IMAGE and prints their top detections.
+    :param backend:     The name of the converted backend.
+    :param image:       A screenshot of the game showing a rune's arrows.
+    :return:            Whether both models predict the same arrows.
+    """
+
+    crop = detection.crop_rune(image)
+    results = {}
+    for name in (backends.DEFAULT_BACKEND, backend):
+        model = backends.load(name)
+        top = detection.top_detections(detection.run_inference(model, [crop])[0])
+        results[name] = top
+        print(f" -  {name}: " + ', '.join(f'{c} ({score:.3f})' for score, _, c in top))
+
+    expected, actual = results[backends.DEFAULT_BACKEND], results[backend]
+    same = [c for _, _, c in expected] == [c for _, _, c in actual]
+    if same and expected:
+        error = np.abs(np.array([s for s, _, _ in expected]) - [s for s, _, _ in actual]).max()
+        print(f' -  Largest score difference: {error:.5f}')
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('backend', choices=sorted(CONVERTERS), help='the format to convert to')
+    parser.add_argument('--check', metavar='IMAGE',
+                        help='a rune screenshot to compare both models on after converting')
+    parser.add_argument('--calibration', metavar='PATH',
+                        help='a directory of rune screenshots to calibrate int8 activations with')
+    args = parser.parse_args()
+
+    saved_model = backends.model_path(backends.DEFAULT_BACKEND)
+    output = backends.model_path(args.backend)
+    print(f"[~] Converting '{saved_model}' to '{output}'")
+    try:
+        CONVERTERS[args.backend](saved_model, output, calibration=args.calibration)
+    except RuntimeError as e:
+        print(f'[!] {e}: {e.__cause__}')
+        sys.exit(1)
+    print(f'[~] Saved {os.path.getsize(output) / 2 ** 20:.1f} MiB model')
+
+    if args.check:
+        image = cv2.imread(args.check)
+        if image is None:
+            parser.error(f"unable to read image '{args.check}'")
+        if compare(args.backend, image):
+            print('[~] Both models predict the same arrows')
+        else:
+            print('[!] The converted model predicts different arrows')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
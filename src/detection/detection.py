@@ -1,22 +1,23 @@
 """A module for classifying directional arrows using TensorFlow."""
 
 import cv2
-import tensorflow as tf
 import numpy as np
-from src.common import utils # pylint: disable=import-error
+from src.common import config, utils # pylint: disable=import-error
+from src.detection import backends # pylint: disable=import-error
 
 
 #########################
 #       Functions       #
 #########################
-def load_model():
+def load_model(backend=None):
     """
-    Loads the saved model's weights into an Tensorflow model.
-    :return:    The Tensorflow model object.
+    Loads the rune model with the given runtime.
+    :param backend:     The name of the backend to run the model with, as listed in
+                        backends.BACKENDS. Defaults to config.model_backend.
+    :return:            The model object.
     """
 
-    model_dir = 'assets/models/rune_model_rnn_grayed/saved_model'
-    return tf.saved_model.load(model_dir)
+    return backends.load(backend or config.model_backend)
 
 def gray(image):
     """
@@ -37,86 +38,153 @@ def preload_cudnn(model, image):
     :param image:   The input image.
     """
 
-    image = gray(image)
-
-    input_tensor = tf.convert_to_tensor(image)
-    input_tensor = input_tensor[tf.newaxis, ...]
-
-    model_fn = model.signatures['serving_default']
-    model_fn(input_tensor)
+    run_inference(model, [gray(image)])
     print("\nPreload cudNN Completed")
 
-def run_inference_for_single_image(model, image):
+def run_inference(model, images):
     """
-    Performs an inference once.
+    Performs inferences on several images, stacking images of the same shape into a single
+    batch so that the overhead of calling the model is paid once per batch instead of once
+    per image. Batches are split into calls of MODEL.batch_size images. The shipped model
+    and its TFLite and ONNX conversions take one image per call, so they get no batching.
+    Only the tensorflow-batched backend runs a whole batch in a single call.
     :param model:   The model object to use.
-    :param image:   The input image.
-    :return:        The model's predictions including bounding boxes and classes.
+    :param images:  A list of input images.
+    :return:        A list of the model's predictions for each image, including bounding
+                    boxes and classes.
     """
 
-    input_tensor = tf.convert_to_tensor(image)
-    input_tensor = input_tensor[tf.newaxis, ...]
+    batch_size = model.batch_size
 
-    model_fn = model.signatures['serving_default']
-    print(model_fn.structured_outputs)
-    output_dict = model_fn(input_tensor)
+    # Only images of the same shape can be stacked together
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(i)
 
-    num_detections = int(output_dict.pop('num_detections'))
-    output_dict = {key: value[0, :num_detections].numpy()
-                   for key, value in output_dict.items()}
-    output_dict['num_detections'] = num_detections
+    results = [None] * len(images)
+    for indices in groups.values():
+        step = batch_size or len(indices)
+        for start in range(0, len(indices), step):
+            batch = indices[start:start + step]
+            output_dict = model(np.stack([images[i] for i in batch]))
 
-    # detection_classes should be ints
-    output_dict['detection_classes'] = output_dict['detection_classes'].astype(np.int64)
+            num_detections = output_dict.pop('num_detections').astype(np.int64)
+            for j, i in enumerate(batch):
+                count = int(num_detections[j])
+                result = {key: value[j, :count] for key, value in output_dict.items()}
+                result['num_detections'] = count
 
-    return output_dict
+                # detection_classes should be ints
+                result['detection_classes'] = result['detection_classes'].astype(np.int64)
+                results[i] = result
+    return results
 
-def sort_by_confidence(model, image):
+def run_inference_for_single_image(model, image):
     """
-    Runs a single inference on the image and returns the best four classifications.
+    Performs an inference once.
     :param model:   The model object to use.
     :param image:   The input image.
-    :return:        The model's top four predictions.
+    :return:        The model's predictions including bounding boxes and classes.
     """
 
-    threshold = 0.8
+    return run_inference(model, [image])[0]
+
+def top_detections(output_dict, threshold=0.8):
+    """
+    Returns the best four classifications of a single inference.
+    :param output_dict:     The model's predictions for one image, as returned by run_inference.
+    :param threshold:       The minimum score of each classification.
+    :return:                Up to four (score, box, class) tuples, most confident first.
+    """
 
-    output_dict = run_inference_for_single_image(model, image)
     zipped = list(zip(output_dict['detection_scores'],
                       output_dict['detection_boxes'],
                       output_dict['detection_classes']))
     pruned = [t for t in zipped if t[0] > threshold]
     pruned.sort(key=lambda x: x[0], reverse=True)
-    result = pruned[:4]
-    return result
+    return pruned[:4]
 
-@utils.run_if_enabled
-def merge_detection(model, image):
+def sort_by_confidence(model, image):
     """
-    Run two inferences: one on the upright image, and one on the image rotated 90 degrees.
-    Only considers vertical arrows and merges the results of the two inferences together.
-    (Vertical arrows in the rotated image are actually horizontal arrows).
+    Runs a single inference on the image and returns the best four classifications.
     :param model:   The model object to use.
     :param image:   The input image.
-    :return:        A list of four arrow directions.
+    :return:        The model's top four predictions.
     """
 
-    label_map = {1: 'up', 2: 'down', 3: 'left', 4: 'right'}
-    classes = []
+    return top_detections(run_inference_for_single_image(model, image))
 
-    # Preprocessing
-    height, width, channels = image.shape
+def crop_rune(image):
+    """
+    Isolates the rune's arrows in a screenshot of the game.
+    :param image:   A BGR or BGRA screenshot of the game.
+    :return:        The grayed area of IMAGE that contains the arrows.
+    """
 
+    height, width = image.shape[:2]
     cropped = image[150:height//3, width//3:4*width//6]
-    grayed = gray(cropped)
+    return gray(cropped)
+
+def batch_detection(model, images, rotate=False):
+    """
+    Classifies the arrows in several screenshots of the same rune with as few model calls as
+    possible. Every screenshot is cropped and stacked into one batch.
+    If ROTATE is True, the batch also contains each crop rotated 90 degrees. Only vertical
+    arrows are then taken from each inference, and the two results are merged together
+    (vertical arrows in the rotated image are actually horizontal arrows).
+    :param model:   The model object to use.
+    :param images:  A list of screenshots of the game.
+    :param rotate:  Whether to also run an inference on each rotated crop.
+    :return:        A list of arrow directions, ordered from left to right, for each image.
+    """
+
+    return batch_classify(model, [crop_rune(image) for image in images], rotate)
+
+def batch_classify(model, crops, rotate=False):
+    """
+    Classifies the arrows in several rune crops with as few model calls as possible.
+    :param model:   The model object to use.
+    :param crops:   A list of rune areas, each as returned by crop_rune.
+    :param rotate:  Whether to also run an inference on each rotated crop.
+    :return:        A list of arrow directions, ordered from left to right, for each crop.
+    """
 
-    # Isolate the rune box
-    height, width, channels = grayed.shape
-    lst = sort_by_confidence(model, grayed)
-    lst.sort(key=lambda x: x[1][1])
-    classes = [label_map[item[2]] for item in lst]
+    label_map = {1: 'up', 2: 'down', 3: 'left', 4: 'right'}
+    rotated_map = {1: 'left', 2: 'right'}
+
+    inputs = list(crops)
+    if rotate:
+        inputs += [cv2.rotate(crop, cv2.ROTATE_90_CLOCKWISE) for crop in crops]
+    outputs = run_inference(model, inputs)
+
+    results = []
+    for i in range(len(crops)):
+        if not rotate:
+            detected = [(box[1], label_map[c]) for _, box, c in top_detections(outputs[i])]
+        else:
+            # Rotating clockwise maps a left arrow onto an up arrow, and x onto y
+            upright = top_detections(outputs[i])
+            rotated = top_detections(outputs[len(crops) + i])
+            detected = [(box[1], label_map[c]) for _, box, c in upright if c in (1, 2)]
+            detected += [(box[0], rotated_map[c]) for _, box, c in rotated if c in (1, 2)]
+        detected.sort(key=lambda x: x[0])
+        results.append([direction for _, direction in detected])
+    return results
+
+@utils.run_if_enabled
+def merge_detection(model, image, rotate=False):
+    """
+    Classifies the arrows in a single screenshot of a rune. If ROTATE is True, runs two
+    inferences: one on the upright image, and one on the image rotated 90 degrees.
+    Only vertical arrows are then considered and the results of the two inferences are
+    merged together. (Vertical arrows in the rotated image are actually horizontal arrows).
+    :param model:   The model object to use.
+    :param image:   The input image.
+    :param rotate:  Whether to also run an inference on the rotated image.
+    :return:        A list of four arrow directions.
+    """
 
-    return classes
+    return batch_detection(model, [image], rotate)[0]
 
 # Script for testing the detection module by itself
 # Testing script so it doesn't matter (javiertzr01)
@@ -0,0 +1,149 @@
+"""A background worker that classifies rune arrows in captured frames as they arrive."""
+
+import queue
+import threading
+from collections import namedtuple
+
+from src.common import config # pylint: disable=import-error
+from src.detection import detection # pylint: disable=import-error
+
+
+# Maximum number of captured frames waiting to be classified. The oldest waiting frame is
+# dropped whenever a new one arrives and the queue is full, so predictions never fall behind.
+# Every frame waiting when the model becomes free is classified in a single batch.
+MAX_PENDING_FRAMES = 4
+
+# Maximum time (in seconds) that the feeder waits for a new frame before rechecking its state
+FEED_TIMEOUT = 0.1
+
+
+# The arrows classified in a single captured frame, tagged with that frame's sequence number
+Prediction = namedtuple('Prediction', ('frame_id', 'arrows'))
+
+
+class InferenceWorker:
+    """
+    Classifies rune arrows off the bot thread. While a session is active, every new frame
+    published by Capture is put into a bounded queue, and a dedicated thread runs the model
+    on all queued frames at once and publishes a Prediction for each of them.
+    """
+
+    def __init__(self, model, max_pending=MAX_PENDING_FRAMES, rotate=False):
+        """
+        Initializes this InferenceWorker's threads.
+        :param model:           The TensorFlow model to classify with.
+        :param max_pending:     The maximum number of frames waiting to be classified.
+        :param rotate:          Whether to also classify each frame rotated 90 degrees.
+        """
+
+        self.model = model
+        self.rotate = rotate
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.predictions = queue.Queue()
+        self.active = threading.Event()
+        self.session = 0                # Incremented on every session to discard stale work
+
+        self.feeder = threading.Thread(target=self._feed)
+        self.feeder.daemon = True
+        self.thread = threading.Thread(target=self._main)
+        self.thread.daemon = True
+
+    def start(self):
+        """Starts this InferenceWorker's threads."""
+
+        self.feeder.start()
+        self.thread.start()
+
+    def begin(self):
+        """
+        Starts classifying every frame captured from now on, discarding any earlier results.
+        :return:    None
+        """
+
+        self.session += 1
+        self._drain(self.frames)
+        self._drain(self.predictions)
+        self.active.set()
+
+    def end(self):
+        """
+        Stops classifying new frames. Frames that are already queued are discarded.
+        :return:    None
+        """
+
+        self.active.clear()
+        self.session += 1
+        self._drain(self.frames)
+
+    def next(self, timeout=None):
+        """
+        Blocks until the next Prediction of the current session is available.
+        :param timeout:     The maximum number of seconds to wait, waits forever if None.
+        :return:            The next Prediction, None if TIMEOUT expired first.
+        """
+
+        try:
+            return self.predictions.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def submit(self, frame):
+        """
+        Queues FRAME to be classified, dropping the oldest queued frame if the queue is full.
+        Only a copy of the rune's area is queued, since FRAME is a view into Capture's ring
+        and may be overwritten before the model gets to it.
+        :param frame:   A Frame tagged with its sequence number.
+        :return:        None
+        """
+
+        item = (self.session, frame.id, detection.crop_rune(frame))
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _feed(self):
+        """Forwards every new frame published by Capture to the queue while a session is active."""
+
+        while True:
+            self.active.wait()
+            frames = config.capture.subscribe()
+            while self.active.is_set():
+                frame = frames.next(timeout=FEED_TIMEOUT)
+                if frame is not None and self.active.is_set():
+                    self.submit(frame)
+
+    def _main(self):
+        """Classifies queued frames and publishes the results."""
+
+        while True:
+            batch = [self.frames.get()]
+            while True:
+                try:
+                    batch.append(self.frames.get_nowait())
+                except queue.Empty:
+                    break
+
+            session = self.session
+            crops = [(frame_id, crop) for s, frame_id, crop in batch if s == session]
+            if not crops or not config.enabled:
+                continue
+            results = detection.batch_classify(self.model, [crop for _, crop in crops], self.rotate)
+            if session == self.session:
+                for (frame_id, _), arrows in zip(crops, results):
+                    self.predictions.put(Prediction(frame_id, arrows))
+
+    @staticmethod
+    def _drain(items):
+        """Removes every item currently in the queue ITEMS."""
+
+        while True:
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                return
@@ -2,6 +2,7 @@
 
 import threading
 import time
+from concurrent.futures import Future
 from os.path import join
 from datetime import datetime
 
@@ -9,7 +10,9 @@ import cv2
 
 # pylint: disable=import-error
 from src.common import config, utils
+from src.common.templates import templates
 from src.detection import detection
+from src.detection.inference import InferenceWorker
 from src.routine.routine import Routine
 from src.command_book.command_book import CommandBook
 from src.routine.components import Point
@@ -17,8 +20,6 @@ from src.common.vkeys import press, click
 from src.common.interfaces import Configurable
 # pylint: enable=import-error
 
-# The rune's buff icon
-RUNE_BUFF_TEMPLATE = cv2.imread('assets/rune_buff_template.jpg', 0)
 PRELOAD_FRAME = cv2.imread('assets/rune_buff_template.jpg')
 
 class Bot(Configurable):
@@ -42,6 +43,10 @@ class Bot(Configurable):
         self.submodules = []
         self.command_book = None            # CommandBook instance
 
+        # Resolves to the InferenceWorker that classifies rune arrows once the model has been
+        # loaded and warmed up in the background
+        self.inference = Future()
+
         config.routine = Routine()
 
         self.ready = False
@@ -55,20 +60,41 @@ class Bot(Configurable):
         """
 
         # self.update_submodules()
+        loader = threading.Thread(target=self._load_detection)
+        loader.daemon = True
+        loader.start()
+
         print('\n[~] Started main bot loop')
         self.thread.start()
 
-    def _main(self):
+    def _load_detection(self):
         """
-        The main body of Bot that executes the user's routine.
+        Loads and warms up the rune detection model, then starts an InferenceWorker with it
+        and resolves this Bot's inference future.
         :return:    None
         """
 
-        print('\n[~] Initializing detection algorithm:\n')
-        model = detection.load_model()
-        detection.preload_cudnn(model, PRELOAD_FRAME)
+        print('\n[~] Initializing detection algorithm in the background')
+        try:
+            model = detection.load_model()
+            detection.preload_cudnn(model, PRELOAD_FRAME)
+            worker = InferenceWorker(model)
+            worker.start()
+        except Exception as e:      # pylint: disable=broad-except
+            # Every backend raises its own errors, and an unresolved future would leave the
+            # bot waiting forever at the first rune
+            print(f'\n[!] Unable to load detection algorithm: {e}')
+            self.inference.set_exception(e)
+            return
+        self.inference.set_result(worker)
         print('\n[~] Initialized detection algorithm')
 
+    def _main(self):
+        """
+        The main body of Bot that executes the user's routine.
+        :return:    None
+        """
+
         self.ready = True
         config.listener.enabled = True
         last_fed = time.time()
@@ -92,18 +118,37 @@ class Bot(Configurable):
                 element = config.routine[config.routine.index]
                 if self.rune_active and isinstance(element, Point) \
                         and element.location == self.rune_closest_pos:
-                    self._solve_rune(model)
+                    self._solve_rune()
+                if isinstance(element, Point):
+                    self._prefetch_path(element)
                 element.execute()
                 config.routine.step()
             else:
                 time.sleep(0.01)
 
+    def _prefetch_path(self, point):
+        """
+        Starts planning the path from POINT to the next Point in the routine in the
+        background, so that it is ready by the time POINT's commands have finished.
+        :param point:   The Point that is about to be executed.
+        :return:        None
+        """
+
+        if config.layout is None:
+            return
+        for offset in range(1, len(config.routine)):
+            upcoming = config.routine[(config.routine.index + offset) % len(config.routine)]
+            if isinstance(upcoming, Point):
+                if upcoming.location != point.location:
+                    config.layout.prefetch(point.location, upcoming.location)
+                return
+
     @utils.run_if_enabled
-    def _solve_rune(self, model):
+    def _solve_rune(self):
         """
-        Moves to the position of the rune and solves the arrow-key puzzle.
-        :param model:   The TensorFlow model to classify with.
-        :param sct:     The mss instance object with which to take screenshots.
+        Moves to the position of the rune and solves the arrow-key puzzle. Frames are
+        classified by the InferenceWorker as they are captured, and the first solution
+        predicted for two different frames is entered.
         :return:        None
         """
 
@@ -114,27 +159,43 @@ class Bot(Configurable):
         time.sleep(0.2)
         press(self.config['Interact'], 1, down_time=0.2)        # Inherited from Configurable
 
-        print('\nSolving rune:')
-        inferences = []
-        fail_count = 0
-        for _ in range(15):
-            if fail_count < 2:
-                frame = config.capture.frame
-                solution = detection.merge_detection(model, frame)
-                if solution:
-                    print(', '.join(solution))
-                    if solution in inferences:
-                        print('Solution found, entering result')
-                        self.enter_solution(solution)
-                        self.solve_rune_success = True
-                        break
-                    elif len(solution) == 4:
-                        inferences.append(solution)
+        if not self.inference.done():
+            print('\n[~] Waiting for detection algorithm to finish initializing')
+        try:
+            inference = self.inference.result()
+        except Exception:       # pylint: disable=broad-except
+            inference = None
+            self.solve_rune_success = False
+
+        if inference is not None:
+            print('\nSolving rune:')
+            inferences = []
+            fail_count = 0
+            inference.begin()
+            try:
+                for _ in range(15):
+                    if fail_count < 2:
+                        prediction = inference.next(timeout=1)
+                        if prediction is None:
+                            continue
+                        solution = prediction.arrows
+                        if solution:
+                            print(', '.join(solution))
+                            if solution in inferences:
+                                print('Solution found, entering result')
+                                inference.end()
+                                self.enter_solution(solution)
+                                self.solve_rune_success = True
+                                break
+                            elif len(solution) == 4:
+                                inferences.append(solution)
+                            else:
+                                fail_count += 1
                     else:
-                        fail_count += 1
-            else:
-                self.solve_rune_success = False
-                break
+                        self.solve_rune_success = False
+                        break
+            finally:
+                inference.end()
 
         if not self.solve_rune_success:
             config.telegram.waiting_response = True
@@ -177,14 +238,14 @@ class Bot(Configurable):
         for _ in range(3):
             time.sleep(0.3)
             frame = config.capture.frame
-            rune_buff = utils.multi_match(frame[:frame.shape[0] // 8, :],
-                                          RUNE_BUFF_TEMPLATE,
-                                          threshold=0.9)
-            if rune_buff:
-                rune_buff_pos = min(rune_buff, key=lambda p: p[0])
+            height, width = frame.shape[:2]
+            gray = config.capture.cache.gray(frame, (0, 0, width, height // 8))
+            rune_buff = templates.match(gray, ('rune_buff',), threshold=0.9)['rune_buff']
+            if len(rune_buff) > 0:
+                rune_buff_pos = rune_buff[rune_buff[:, 0].argmin()]
                 target = (
-                    round(rune_buff_pos[0] + config.capture.window['left']),
-                    round(rune_buff_pos[1] + config.capture.window['top'])
+                    round(float(rune_buff_pos[0]) + config.capture.window['left']),
+                    round(float(rune_buff_pos[1]) + config.capture.window['top'])
                 )
                 click(target, button='right')
         self.rune_active = False
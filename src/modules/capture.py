@@ -1,14 +1,24 @@
 """A module for tracking useful in-game information."""
+import ctypes
 import threading
 import time
+from os.path import basename, splitext
 
 import cv2
-import win32gui
-import win32ui
-import win32con
 import numpy as np
+try:
+    import win32gui
+    import win32ui
+    import win32con
+except ImportError:     # Frames can only be replayed from a FrameSource off Windows
+    win32gui = win32ui = win32con = None
 
 from src.common import config, utils # pylint: disable=import-error
+from src.common.frame_sources import FrameSource # pylint: disable=import-error
+from src.common.frame_archive import FrameArchiveWriter # pylint: disable=import-error
+from src.common.tracking import PlayerTracker, MotionState # pylint: disable=import-error
+from src.common.preprocessing import FrameCache # pylint: disable=import-error
+from src.common.templates import templates # pylint: disable=import-error
 
 # The distance between the top of the minimap and the top of the screen
 MINIMAP_TOP_BORDER = 5
@@ -29,16 +39,234 @@ X_0 = BORDER_PIXELS
 Y_0 = TITLEBAR_PIXELS
 
 # The top-left and bottom-right corners of the minimap
-MM_TL_TEMPLATE = cv2.imread('assets/minimap_tl_template.png', 0)
-MM_BR_TEMPLATE = cv2.imread('assets/minimap_br_template.png', 0)
+MM_TL_TEMPLATE = templates['minimap_tl']
+MM_BR_TEMPLATE = templates['minimap_br']
 
 MMT_HEIGHT = max(MM_TL_TEMPLATE.shape[0], MM_BR_TEMPLATE.shape[0]) #22
 MMT_WIDTH = max(MM_TL_TEMPLATE.shape[1], MM_BR_TEMPLATE.shape[1]) #37
 
+# The minimum normalized correlation of both corner templates at their cached positions
+# for a cached minimap calibration to still be considered valid
+CALIBRATION_THRESHOLD = 0.9
+
 # The player's symbol on the minimap
-PLAYER_TEMPLATE = cv2.imread('assets/player_template.png', 0)
+PLAYER_TEMPLATE = templates['player']
 PT_HEIGHT, PT_WIDTH = PLAYER_TEMPLATE.shape
 
+# The title of the game window
+WINDOW_NAME = 'MapleStory'
+
+# Weight given to the newest sample in the running average of capture latency
+LATENCY_SMOOTHING = 0.05
+
+# Number of preallocated frame buffers that screenshots are written into in turn
+FRAME_RING_SIZE = 4
+
+# Minimum time (in seconds) between two full-frame captures once the minimap is calibrated.
+# Only the minimap is captured in between. Set to 0 to capture the full frame every time.
+FULL_FRAME_INTERVAL = 0.05
+
+
+class Frame(np.ndarray):
+    """
+    A read-only view of a captured frame that is tagged with its sequence number. Crops of
+    a Frame keep the sequence number of the Frame they were taken from.
+    """
+
+    def __array_finalize__(self, obj):
+        self.id = getattr(obj, 'id', 0)
+
+
+class FrameRing:
+    """
+    A small ring of preallocated frame buffers. Each screenshot is written in place into
+    the next buffer, so capturing a frame does not allocate a new array. A buffer is only
+    overwritten once every FRAME_RING_SIZE frames, so consumers that hold on to a frame for
+    longer than that should copy it first.
+    """
+
+    def __init__(self, size=FRAME_RING_SIZE):
+        """
+        Initializes an empty ring with SIZE slots.
+        :param size:    The number of buffers in the ring.
+        """
+
+        self.size = size
+        self.shape = None
+        self.buffers = []
+        self.index = 0
+
+    def next(self, height, width):
+        """
+        Returns the next writable buffer in the ring, reallocating every buffer if the
+        dimensions of the frame have changed.
+        :param height:  The height of the frame in pixels.
+        :param width:   The width of the frame in pixels.
+        :return:        A writable BGRA buffer of shape (HEIGHT, WIDTH, 4).
+        """
+
+        shape = (height, width, 4)
+        if shape != self.shape:
+            self.shape = shape
+            self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.size)]
+            self.index = 0
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % self.size
+        return buffer
+
+
+class GDIFrameSource(FrameSource):
+    """
+    Screenshots the game window using Win32 GDI. Holds the window handle, device contexts and
+    bitmaps needed to do so, which are created once and reused across frames, and are only
+    rebuilt when the size of the window changes or its handle is no longer valid.
+    """
+
+    def __init__(self, window_name):
+        """
+        Initializes an empty GDI source for the window titled WINDOW_NAME.
+        :param window_name:     The title of the window to capture.
+        """
+
+        super().__init__()
+        self.window_name = window_name
+        self.hwnd = None
+        self.w_dc = None
+        self.dc_obj = None
+        self.c_dc = None
+        self.bitmaps = {}       # Maps (width, height) to a compatible bitmap of that size
+
+    def acquire(self):
+        """
+        Makes sure that the source's GDI objects match the current state of the game window,
+        rebuilding them if necessary.
+        :return:    Whether the game window is available for capture.
+        """
+
+        if self.hwnd is None or not win32gui.IsWindow(self.hwnd):
+            self.release()
+            self.hwnd = win32gui.FindWindow(None, self.window_name)
+            if not self.hwnd:
+                self.hwnd = None
+                return False
+
+        rect = win32gui.GetWindowRect(self.hwnd)
+        width = max(rect[2] - rect[0], MMT_WIDTH) - (BORDER_PIXELS * 2)
+        height = max(rect[3] - rect[1], MMT_HEIGHT) - TITLEBAR_PIXELS - BORDER_PIXELS
+        if self.c_dc is None or width != self.width or height != self.height:
+            self._release_dcs()
+            self.width = width
+            self.height = height
+            self.w_dc = win32gui.GetWindowDC(self.hwnd)
+            self.dc_obj = win32ui.CreateDCFromHandle(self.w_dc)
+            self.c_dc = self.dc_obj.CreateCompatibleDC()
+        self.rect = rect
+        return True
+
+    def grab(self, ring, region=None):
+        """
+        Copies the contents of the game window into one of the source's bitmaps, and then
+        copies the bitmap's pixels directly into the next buffer of RING.
+        :param ring:    The FrameRing to write the screenshot into.
+        :param region:  The (left, top, right, bottom) bounds of the area to capture, relative
+                        to the game screen. Captures the whole screen if None.
+        :return:        The filled BGRA buffer, None if the window could not be captured.
+        """
+
+        try:
+            if not self.acquire():
+                return None
+            if region is None:
+                region = (0, 0, self.width, self.height)
+            left, top, right, bottom = region
+            width, height = right - left, bottom - top
+            bitmap = self._bitmap(width, height)
+            self.c_dc.SelectObject(bitmap)
+            self.c_dc.BitBlt((0, 0), (width, height),
+                             self.dc_obj, (X_0 + left, Y_0 + top), win32con.SRCCOPY)
+        except (win32ui.error, win32gui.error):
+            self.release()
+            return None
+
+        buffer = ring.next(height, width)
+        copied = ctypes.windll.gdi32.GetBitmapBits(ctypes.c_void_p(bitmap.GetHandle()),
+                                                   buffer.nbytes,
+                                                   ctypes.c_void_p(buffer.ctypes.data))
+        if copied != buffer.nbytes:
+            self.release()
+            return None
+        return buffer
+
+    def release(self):
+        """Frees all GDI objects held by this source."""
+
+        self._release_dcs()
+        self.hwnd = None
+        self.rect = None
+
+    def _bitmap(self, width, height):
+        """Returns a compatible bitmap of the given size, creating it if necessary."""
+
+        key = (width, height)
+        if key not in self.bitmaps:
+            bitmap = win32ui.CreateBitmap()
+            bitmap.CreateCompatibleBitmap(self.dc_obj, width, height)
+            self.bitmaps[key] = bitmap
+        return self.bitmaps[key]
+
+    def _release_dcs(self):
+        """Frees the device contexts and bitmaps, keeping the window handle."""
+
+        try:
+            if self.dc_obj is not None:
+                self.dc_obj.DeleteDC()
+            if self.c_dc is not None:
+                self.c_dc.DeleteDC()
+            if self.w_dc is not None:
+                win32gui.ReleaseDC(self.hwnd, self.w_dc)
+            for bitmap in self.bitmaps.values():
+                win32gui.DeleteObject(bitmap.GetHandle())
+        except (win32ui.error, win32gui.error):
+            pass
+        self.w_dc = None
+        self.dc_obj = None
+        self.c_dc = None
+        self.bitmaps = {}
+
+
+class FrameSubscription:
+    """
+    Allows a consumer to block until Capture publishes a frame that the consumer has not
+    seen yet, so that the same frame is never processed twice.
+    """
+
+    def __init__(self, capture):
+        """
+        Subscribes to frames published by CAPTURE after the current one.
+        :param capture:     The Capture object to subscribe to.
+        """
+
+        self.capture = capture
+        self.last_id = capture.frame_id
+
+    def next(self, timeout=None):
+        """
+        Blocks until a frame newer than the last one returned by this subscription is published.
+        :param timeout:     The maximum number of seconds to wait, waits forever if None.
+        :return:            The newest Frame, None if TIMEOUT expired before it was published.
+        """
+
+        def is_new():
+            frame = self.capture.frame
+            return frame is not None and frame.id > self.last_id
+
+        with self.capture.frame_ready:
+            if not self.capture.frame_ready.wait_for(is_new, timeout):
+                return None
+            frame = self.capture.frame
+        self.last_id = frame.id
+        return frame
+
 
 class Capture:
     """
@@ -47,15 +275,24 @@ class Capture:
     displays the minimap in a pop-up window.
     """
 
-    def __init__(self):
-        """Initializes this Capture object's main thread."""
+    def __init__(self, source=None):
+        """
+        Initializes this Capture object's main thread.
+        :param source:  The FrameSource to take screenshots from, defaults to the game window.
+        """
+
+        if source is None and win32gui is None:
+            raise ImportError('Capturing the game window requires pywin32, set REPLAY_PATH '
+                              'or pass a FrameSource to replay recorded frames instead')
 
         config.capture = self
+        config.player_state = MotionState()
 
         self.frame = None
         self.minimap = {}
         self.minimap_ratio = 1
         self.minimap_sample = None
+        self.calibrations = {}          # Maps (width, height, routine) to the minimap's corners
         self.sct = None
         self.window = {
             'left': 0,
@@ -65,6 +302,30 @@ class Capture:
         }
 
         self.fourcc = cv2.VideoWriter_fourcc(*'avc1')
+        self.recorder = None            # FrameArchiveWriter for the current recording session
+        self.recording_path = None
+        self.recording_part = 0         # Incremented each time a resize starts a new archive
+        self.recording_lock = threading.Lock()
+
+        # Where screenshots are taken from
+        self.source = source if source is not None else GDIFrameSource(WINDOW_NAME)
+        self.ring = FrameRing()
+        self.minimap_ring = FrameRing(size=2)
+        self.full_frame_interval = FULL_FRAME_INTERVAL
+        self.frame_id = 0
+        self.frame_ready = threading.Condition()
+
+        # Grayscale and colour class versions of recent frames shared by all consumers
+        self.cache = FrameCache()
+
+        # Follows the player's symbol across minimap captures
+        self.tracker = PlayerTracker(PLAYER_TEMPLATE, threshold=0.8)
+
+        # Time taken (in seconds) to capture a single full frame or minimap
+        self.latency = {
+            'frame': {'last': 0, 'average': 0},
+            'minimap': {'last': 0, 'average': 0}
+        }
 
         self.ready = False
         self.calibrated = False
@@ -81,11 +342,10 @@ class Capture:
         """Constantly monitors the player's position and in-game events."""
         while True:
             # Calibrate by finding the top-left and bottom-right corners of the minimap
-            self.frame = self.screenshot()
-            if self.frame is None:
+            if not self._update_frame():
+                time.sleep(0.01)
                 continue
-            top_left, _ = utils.single_match(self.frame, MM_TL_TEMPLATE)
-            _, bottom_right = utils.single_match(self.frame, MM_BR_TEMPLATE)
+            top_left, bottom_right = self._find_minimap_corners()
             mm_tl = (
                 top_left[0] + MINIMAP_BOTTOM_BORDER,
                 top_left[1] + MINIMAP_TOP_BORDER
@@ -95,27 +355,45 @@ class Capture:
                 max(mm_tl[1] + PT_HEIGHT, bottom_right[1] - MINIMAP_BOTTOM_BORDER) #487vs476
             )
             self.minimap_ratio = (mm_br[0] - mm_tl[0]) / (mm_br[1] - mm_tl[1])
-            self.minimap_sample = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]]
+            self.minimap_sample = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]].copy()
             # cv2.imshow("calibrate", self.minimap_sample)
             # cv2.waitKey(0)
             # cv2.destroyAllWindows() 
+            self.tracker.reset()
+            config.player_state.reset()
             self.calibrated = True
+            last_full_frame = time.perf_counter()
             while True:
                 if not self.calibrated:
                     break
 
-                # Take screenshot 
-                self.frame = self.screenshot()
-                if self.frame is None:
-                    continue
-
-                # Crop the frame to only show the minimap
-                minimap = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]]
+                # Take a full screenshot for the Notifier and rune solver every so often,
+                # otherwise only capture the minimap
+                now = time.perf_counter()
+                if now - last_full_frame >= self.full_frame_interval:
+                    if not self._update_frame():
+                        continue
+                    last_full_frame = now
+                    minimap = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]]
+                else:
+                    minimap = self.screenshot_region((*mm_tl, *mm_br))
+                    if minimap is None:
+                        continue
+
+                # Copy the minimap since the GUI keeps it around for longer than
+                # it stays in the ring, and tag it so its derived images can be cached
+                minimap = minimap.copy().view(Frame)
+                self.frame_id += 1
+                minimap.id = self.frame_id
 
                 # Determine the player's position
-                player = utils.multi_match(minimap, PLAYER_TEMPLATE, threshold=0.8)
-                if player: 
-                    config.player_pos = utils.convert_to_relative(player[0], minimap)
+                player = self.tracker.locate(minimap)
+                if player is not None:
+                    config.player_state.update(utils.convert_to_relative(player, minimap), now)
+                else:
+                    config.player_state.miss(now)
+                if config.player_state.position is not None:
+                    config.player_pos = config.player_state.position
 
                 # Package display information to be polled by GUI 
                 self.minimap = {
@@ -130,45 +408,161 @@ class Capture:
                     self.ready = True
                 time.sleep(0.001)
 
+    def _find_minimap_corners(self):
+        """
+        Finds the top-left and bottom-right corners of the minimap in the current frame. Reuses
+        the corners previously found for the same window size and routine if both templates
+        still match there, and only searches the whole frame otherwise.
+        :return:    The top-left corner of MM_TL_TEMPLATE and bottom-right corner of MM_BR_TEMPLATE.
+        """
+
+        key = (self.window['width'], self.window['height'],
+               basename(config.routine.path) if config.routine else '')
+        cached = self.calibrations.get(key)
+        if cached is not None and self._corners_match(*cached):
+            return cached
+
+        corners = templates.best(self.cache.gray(self.frame), ('minimap_tl', 'minimap_br'))
+        top_left, _ = corners['minimap_tl']
+        _, bottom_right = corners['minimap_br']
+        if self._corners_match(top_left, bottom_right):
+            self.calibrations[key] = (top_left, bottom_right)
+        return top_left, bottom_right
+
+    def _corners_match(self, top_left, bottom_right):
+        """Returns whether both corner templates still match the current frame at the given corners."""
+
+        br_height, br_width = MM_BR_TEMPLATE.shape
+        br_top_left = (bottom_right[0] - br_width, bottom_right[1] - br_height)
+        return utils.match_score(self.frame, MM_TL_TEMPLATE, top_left) >= CALIBRATION_THRESHOLD \
+            and utils.match_score(self.frame, MM_BR_TEMPLATE, br_top_left) >= CALIBRATION_THRESHOLD
+
+    def subscribe(self):
+        """
+        Returns a new subscription to the frames published by this Capture.
+        :return:    A FrameSubscription that yields frames captured after this call.
+        """
+
+        return FrameSubscription(self)
+
+    def _update_frame(self):
+        """
+        Takes a screenshot and publishes it to all subscribers.
+        :return:    Whether a new frame was captured.
+        """
+
+        frame = self.screenshot()
+        if frame is None:
+            return False
+        with self.frame_ready:
+            self.frame = frame
+            self.frame_ready.notify_all()
+
+        with self.recording_lock:
+            if self.recorder is not None:
+                window = self.window
+                metadata = (time.time(),
+                            (window['left'], window['top'], window['width'], window['height']),
+                            config.player_pos, config.enabled)
+                if not self.recorder.append(frame, *metadata):
+                    # Archives hold a single frame shape, so continue in a new one after a resize
+                    self._close_recorder()
+                    self.recording_part += 1
+                    root, ext = splitext(self.recording_path)
+                    self._open_recorder(f'{root}.{self.recording_part}{ext}', frame.shape)
+                    self.recorder.append(frame, *metadata)
+        return True
+
+    def start_recording(self, path):
+        """
+        Starts appending every full frame, along with its metadata, to a frame archive.
+        :param path:    The path to save the archive to.
+        :return:        None
+        """
+
+        with self.recording_lock:
+            self._close_recorder()
+            self.recording_path = path
+            self.recording_part = 0
+            self._open_recorder(path, (self.window['height'], self.window['width']))
+
+    def stop_recording(self):
+        """Stops the current recording session, if any, and finalizes its archive."""
+
+        with self.recording_lock:
+            self._close_recorder()
+
+    def _open_recorder(self, path, shape):
+        """Starts a new archive at PATH for frames of the given (height, width[, channels]) SHAPE."""
+
+        self.recorder = FrameArchiveWriter(path, *shape)
+        print(f"\n[~] Started recording session to '{path}'")
+
+    def _close_recorder(self):
+        """Finalizes the current archive, if any. Must be called with RECORDING_LOCK held."""
+
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            recorder.close()
+            print(f"\n[~] Saved {recorder.count} frames to '{recorder.path}'")
+
     def screenshot(self):
         """
-        Takes a screenshot of the game
+        Takes a screenshot of the game using the frame source
         Returns:
-            image : a cv2 accessible numpy array
-        """
-        hwnd = win32gui.FindWindow(None, 'MapleStory')
-        wDC = win32gui.GetWindowDC(hwnd)
-
-        # Calibrate screen capture
-        rect = win32gui.GetWindowRect(hwnd)
-        self.window['left'] = rect[0]
-        self.window['top'] = rect[1]
-        self.window['width'] = max(rect[2] - rect[0], MMT_WIDTH)
-        self.window['height'] = max(rect[3] - rect[1], MMT_HEIGHT)
-
-        # Calibrate to remove extra space from width and height
-        self.window['width'] = self.window['width'] - (BORDER_PIXELS * 2)
-        self.window['height'] = self.window['height'] - TITLEBAR_PIXELS - BORDER_PIXELS
-        dcObj=win32ui.CreateDCFromHandle(wDC)
-        cDC=dcObj.CreateCompatibleDC()
-        dataBitMap = win32ui.CreateBitmap()
-        dataBitMap.CreateCompatibleBitmap(dcObj, self.window['width'], self.window['height'])
-        cDC.SelectObject(dataBitMap)
-        cDC.BitBlt((0,0),(self.window['width'], self.window['height']) , dcObj, (X_0, Y_0), win32con.SRCCOPY)
-
-        # Conversion to cv2-compaitible
-        signedIntsArray = dataBitMap.GetBitmapBits(True)
-        image = np.fromstring(signedIntsArray, dtype='uint8')
-        image.shape = (self.window['height'], self.window['width'], 4)
-
-        # Free Resources
-        dcObj.DeleteDC()
-        cDC.DeleteDC()
-        win32gui.ReleaseDC(hwnd, wDC)
-        win32gui.DeleteObject(dataBitMap.GetHandle())
-
+            frame : a read-only Frame tagged with its sequence number,
+                    None if the game window could not be captured
+        """
+        start = time.perf_counter()
+        buffer = self.source.grab(self.ring)
+        if buffer is None:
+            return None
+        self.frame_id += 1
+        frame = buffer.view(Frame)
+        frame.id = self.frame_id
+        frame.flags.writeable = False
+
+        self.window['left'], self.window['top'] = self.source.rect[:2]
+        self.window['width'] = self.source.width
+        self.window['height'] = self.source.height
+
+        self._record_latency('frame', time.perf_counter() - start)
+        return frame
+
+    def screenshot_region(self, region):
+        """
+        Takes a screenshot of only part of the game
+        Args:
+            region : the (left, top, right, bottom) bounds of the area to capture
+        Returns:
+            image : a read-only BGRA numpy array, None if the game window could not be captured
+        """
+        start = time.perf_counter()
+        buffer = self.source.grab(self.minimap_ring, region=region)
+        if buffer is None:
+            return None
+        image = buffer.view()
+        image.flags.writeable = False
+
+        self._record_latency('minimap', time.perf_counter() - start)
         return image
-    
+
+    def _record_latency(self, kind, elapsed):
+        """
+        Updates the latency statistics of the given KIND of capture.
+        :param kind:        Either 'frame' or 'minimap'.
+        :param elapsed:     The time (in seconds) that the capture took.
+        :return:            None
+        """
+
+        stats = self.latency[kind]
+        stats['last'] = elapsed
+        if stats['average'] == 0:
+            stats['average'] = elapsed
+        else:
+            stats['average'] += LATENCY_SMOOTHING * (elapsed - stats['average'])
+
     def record(self, path, fourcc, frame_rate=28, duration=0, x0=X_0, x1=None, y0=Y_0, y1=None):
         """
         Records the game
@@ -4,7 +4,6 @@ import time
 import os
 import threading
 
-import cv2
 import pygame
 
 import numpy as np
@@ -13,25 +12,12 @@ import keyboard as kb
 # pylint: disable=import-error
 from src.routine.components import Point
 from src.common import config, utils
+from src.common.templates import templates, colors
 # pylint: enable = import-error
 
 
-# A rune's symbol on the minimap
-RUNE_RANGES = (
-    ((141, 148, 245), (146, 158, 255)),
-)
-rune_filtered = utils.filter_color(cv2.imread('assets/rune_template.png'), RUNE_RANGES)
-RUNE_TEMPLATE = cv2.cvtColor(rune_filtered, cv2.COLOR_BGR2GRAY)
-
-# Other players' symbols on the minimap
-OTHER_RANGES = (
-    ((0, 245, 215), (10, 255, 255)),
-)
-other_filtered = utils.filter_color(cv2.imread('assets/other_template.png'), OTHER_RANGES)
-OTHER_TEMPLATE = cv2.cvtColor(other_filtered, cv2.COLOR_BGR2GRAY)
-
-# The Elite Boss's warning sign
-ELITE_TEMPLATE = cv2.imread('assets/elite_template.jpg', 0)
+# The number of pixels in a single other player's icon, used to count overlapping icons
+OTHER_ICON_AREA = np.count_nonzero(templates['other'])
 
 
 def get_alert_path(name):
@@ -54,6 +40,13 @@ class Notifier:
         self.room_change_threshold = 0.9
         self.rune_alert_delay = 270         # 4.5 minutes
 
+        # The range of areas (in pixels) of the colour blobs counted as each minimap icon.
+        # Other players' icons can overlap, so their blobs have no maximum area.
+        self.blob_areas = {
+            'rune': (12, 50),
+            'other': (10, None)
+        }
+
     def start(self):
         """Starts this Notifier's thread."""
 
@@ -64,26 +57,32 @@ class Notifier:
         self.ready = True
         prev_others = 0
         rune_start_time = time.time()
+        frames = config.capture.subscribe()
         while True:
             if config.enabled:
-                frame = config.capture.frame
+                frame = frames.next(timeout=1)
+                if frame is None:
+                    continue
                 height, width, _ = frame.shape
                 minimap = config.capture.minimap['minimap']
+                cache = config.capture.cache
 
                 # Check for unexpected black screen
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                gray = cache.gray(frame)
                 if np.count_nonzero(gray < 15) / height / width > self.room_change_threshold:
                     self._alert('siren')
 
                 # Check for elite warning
-                elite_frame = frame[height // 4:3 * height // 4, width // 4:3 * width // 4]
-                elite = utils.multi_match(elite_frame, ELITE_TEMPLATE, threshold=0.9)
+                elite_frame = gray[height // 4:3 * height // 4, width // 4:3 * width // 4]
+                elite = templates.match(elite_frame, ('elite',), threshold=0.9)['elite']
                 if len(elite) > 0:
                     self._alert('siren')
 
                 # Check for other players entering the map
-                filtered = utils.filter_color(minimap, OTHER_RANGES)
-                others = len(utils.multi_match(filtered, OTHER_TEMPLATE, threshold=0.5))
+                classes = cache.color_classes(minimap, colors)
+                blobs = utils.find_blobs(colors.select(classes, 'other'),
+                                         *self.blob_areas['other'])
+                others = int(np.maximum(1, np.round(blobs[:, 2] / OTHER_ICON_AREA)).sum())
                 config.stage_fright = others > 0
                 if others != prev_others:
                     if others > prev_others:
@@ -93,11 +92,11 @@ class Notifier:
                 # Check for rune
                 now = time.time()
                 if not config.bot.rune_active:
-                    filtered = utils.filter_color(minimap, RUNE_RANGES)
-                    matches = utils.multi_match(filtered, RUNE_TEMPLATE, threshold=0.9)
+                    matches = utils.find_blobs(colors.select(classes, 'rune'),
+                                               *self.blob_areas['rune'])
                     rune_start_time = now
-                    if matches and config.routine.sequence:
-                        abs_rune_pos = (matches[0][0], matches[0][1])
+                    if len(matches) > 0 and config.routine.sequence:
+                        abs_rune_pos = (float(matches[0][0]), float(matches[0][1]))
                         config.bot.rune_pos = utils.convert_to_relative(abs_rune_pos, minimap)
                         distances = list(map(distance_to_rune, config.routine.sequence))
                         index = np.argmin(distances)
@@ -107,7 +106,8 @@ class Notifier:
                 elif now - rune_start_time > self.rune_alert_delay:     # Alert if rune hasn't been solved
                     config.bot.rune_active = False
                     self._alert('siren')
-            time.sleep(0.05)
+            else:
+                time.sleep(0.05)
 
     def _alert(self, name, volume=0.75):
         """
@@ -265,7 +265,7 @@ class Move(Command):
                             config.layout.add(*config.player_pos)
                         counter -= 1
                         if i < len(path) - 1:
-                            time.sleep(0.15)
+                            config.player_state.wait_until_settled(0.15)
                 else:
                     d_y = point[1] - config.player_pos[1]
                     if abs(d_y) > settings.move_tolerance / math.sqrt(2):
@@ -279,7 +279,7 @@ class Move(Command):
                             config.layout.add(*config.player_pos)
                         counter -= 1
                         if i < len(path) - 1:
-                            time.sleep(0.05)
+                            config.player_state.wait_until_settled(0.05)
                 local_error = utils.distance(config.player_pos, point)
                 global_error = utils.distance(config.player_pos, self.target)
                 toggle = not toggle
@@ -308,6 +308,17 @@ def step(direction, target):
     config.enabled = False
 
 
+def predicted_pos(lead=0.05):
+    """
+    Predicts where the player will be shortly from now based on their current velocity.
+    :param lead:    How many seconds ahead to predict, defaults to one polling interval.
+    :return:        The predicted position, or the last known position if there is none.
+    """
+
+    predicted = config.player_state.predict(time.perf_counter() + lead)
+    return config.player_pos if predicted is None else predicted
+
+
 class Wait(Command):
     """Waits for a set amount of time."""
 
@@ -4,13 +4,80 @@ import os
 import cv2
 import math
 import pickle
+import struct
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
 from src.common import config, settings, utils
 from os.path import join, isfile, splitext, basename
 from heapq import heappush, heappop
 
 
+# Number of points added to a PointIndex before they are merged into its sorted array
+MERGE_SIZE = 256
+
+# Maximum number of points above and below a position that a single vertical teleport is
+# considered to, nearest first. Farther points in the same column are reached through these.
+VERTICAL_NEIGHBORS = 8
+
+# Maximum number of points to each side of a position that a single horizontal teleport is
+# considered to, spread evenly from the nearest to the farthest one in range
+HORIZONTAL_NEIGHBORS = 8
+
+# Maximum number of points expanded by a single search. A search that runs out of expansions,
+# such as one towards an unreachable target, leads to the closest point found so far.
+MAX_EXPANSIONS = 64
+
+# Weight given to the distance left to the target when choosing which point to expand next.
+# Values above 1 trade paths up to that factor longer than the shortest one for far fewer
+# expansions, since many points of a dense layout lie on almost equally short paths.
+HEURISTIC_WEIGHT = 1.2
+
+# Maximum number of shortest paths remembered by each Layout
+PATH_CACHE_SIZE = 256
+
+# Size of the cells that sources and targets are snapped to when looking up cached paths,
+# as a fraction of the move tolerance
+PATH_CACHE_CELL = 0.25
+
+# Maximum number of prefetched paths waiting to be used by each Layout, one per target
+PREFETCH_SIZE = 4
+
+# Identifies a file as a layout, followed by the version of its format
+LAYOUT_MAGIC = b'AMLY'
+LAYOUT_VERSION = 1
+
+# Magic, version and number of points
+LAYOUT_HEADER = struct.Struct('<4sIQ')
+LAYOUT_HEADER_SIZE = 64
+
+# File extension of layout files
+LAYOUT_EXTENSION = '.layout'
+
+
+def search_sorted(points, x_min, x_max, y_min, y_max):
+    """
+    Returns the indices of the points within a range.
+    :param points:  An (N, 2) array of points sorted by x-position.
+    :param x_min:   The left boundary of the range.
+    :param x_max:   The right boundary of the range.
+    :param y_min:   The bottom boundary of the range.
+    :param y_max:   The top boundary of the range.
+    :return:        An array of indices into POINTS.
+    """
+
+    lo = np.searchsorted(points[:, 0], x_min, side='left')
+    hi = np.searchsorted(points[:, 0], x_max, side='right')
+    ys = points[lo:hi, 1]
+    return lo + np.flatnonzero((ys >= y_min) & (ys <= y_max))
+
+
 class Node:
-    """Represents a vertex on a quadtree."""
+    """
+    Represents a vertex on a quadtree. Layouts used to be stored as quadtrees of Nodes, so
+    this class is kept to unpickle them.
+    """
 
     def __init__(self, x, y):
         """
@@ -61,8 +128,345 @@ class Node:
         yield self.y
 
 
+class PointIndex:
+    """
+    Stores points in a contiguous array sorted by x-position, so that a range query is a
+    binary search for its horizontal bounds followed by a vectorized check of its vertical
+    bounds. Its shape does not depend on the order in which points are added. New points are
+    kept in a small unsorted buffer that is merged into the sorted array once it fills up.
+    """
+
+    def __init__(self, points=()):
+        """
+        Creates a new PointIndex.
+        :param points:  An iterable of (x, y) points to start with.
+        """
+
+        self.points = np.empty((0, 2))
+        self.pending = np.empty((MERGE_SIZE, 2))
+        self.count = 0          # Number of points in the pending buffer
+        self.extend(points)
+
+    def add(self, x, y):
+        """
+        Adds the point (X, Y) to this index.
+        :param x:   The x-position of the point.
+        :param y:   The y-position of the point.
+        :return:    None
+        """
+
+        self.pending[self.count] = (x, y)
+        self.count += 1
+        if self.count == len(self.pending):
+            self._merge()
+
+    def extend(self, points):
+        """
+        Adds every point in POINTS to this index at once.
+        :param points:  An iterable or (N, 2) array of (x, y) points.
+        :return:        None
+        """
+
+        points = np.asarray(list(points) if not isinstance(points, np.ndarray) else points,
+                            dtype=np.float64).reshape(-1, 2)
+        if len(points):
+            self._merge(points)
+
+    def search(self, x_min, x_max, y_min, y_max):
+        """
+        Returns every point bounded horizontally by X_MIN and X_MAX, and vertically by
+        Y_MIN and Y_MAX.
+        :param x_min:   The left boundary of the range.
+        :param x_max:   The right boundary of the range.
+        :param y_min:   The bottom boundary of the range.
+        :param y_max:   The top boundary of the range.
+        :return:        An (N, 2) array of the points in the range.
+        """
+
+        found = self.points[search_sorted(self.points, x_min, x_max, y_min, y_max)]
+        if self.count:
+            pending = self.pending[:self.count]
+            inside = (pending[:, 0] >= x_min) & (pending[:, 0] <= x_max) \
+                & (pending[:, 1] >= y_min) & (pending[:, 1] <= y_max)
+            if inside.any():
+                found = np.concatenate((found, pending[inside]))
+        return found
+
+    @classmethod
+    def from_sorted(cls, points):
+        """
+        Creates a PointIndex that uses POINTS as its sorted array without copying them.
+        :param points:  An (N, 2) array of points that is already sorted by x-position.
+        :return:        A PointIndex.
+        """
+
+        index = cls()
+        index.points = points
+        return index
+
+    def all(self):
+        """Returns an (N, 2) array of every point in this index."""
+
+        if self.count:
+            return np.concatenate((self.points, self.pending[:self.count]))
+        return self.points
+
+    def sorted(self):
+        """Returns an (N, 2) array of every point in this index, sorted by x-position."""
+
+        if self.count:
+            self._merge()
+        return self.points
+
+    def _merge(self, points=None):
+        """Merges the pending buffer, and POINTS if given, into the sorted array."""
+
+        merged = [self.points, self.pending[:self.count]]
+        if points is not None:
+            merged.append(points)
+        merged = np.concatenate(merged)
+        self.points = merged[np.argsort(merged[:, 0], kind='stable')]
+        self.count = 0
+
+    def __len__(self):
+        return len(self.points) + self.count
+
+
+class NavigationGraph:
+    """
+    A graph over the points of a Layout whose edges are the horizontal and vertical teleports
+    that can be made between them under a given move tolerance. Every edge is found when the
+    graph is created and stored in flat arrays, with the edges leaving point i at positions
+    OFFSETS[i] to OFFSETS[i + 1], so that searches only look them up.
+    """
+
+    def __init__(self, points, tolerance):
+        """
+        Creates a NavigationGraph over POINTS.
+        :param points:      An (N, 2) array of points sorted by x-position.
+        :param tolerance:   The move tolerance that teleports are made with.
+        """
+
+        self.points = points
+        self.tolerance = tolerance
+        self.xs = points[:, 0].tolist()
+        self.ys = points[:, 1].tolist()
+
+        offsets = [0]
+        targets, costs = [], []
+        for position in points:
+            neighbors, distances = self.reachable(position)
+            targets += neighbors
+            costs += distances
+            offsets.append(len(targets))
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+
+        # Label the groups of points that are connected by teleports in either direction
+        parents = list(range(len(points)))
+
+        def find(vertex):
+            while parents[vertex] != vertex:
+                parents[vertex] = parents[parents[vertex]]
+                vertex = parents[vertex]
+            return vertex
+
+        for vertex in range(len(points)):
+            for neighbor in targets[offsets[vertex]:offsets[vertex + 1]]:
+                parents[find(neighbor)] = find(vertex)
+        self.components = np.array([find(vertex) for vertex in range(len(points))], dtype=np.int64)
+
+    def neighbors(self, vertex):
+        """
+        Returns the points that can be reached from the point at index VERTEX in one teleport.
+        :param vertex:  The index of a point in this graph.
+        :return:        A list of the indices of its neighbors, and a list of the distance
+                        to each of them.
+        """
+
+        start, end = self.offsets[vertex], self.offsets[vertex + 1]
+        return self.targets[start:end], self.costs[start:end]
+
+    def reachable(self, position):
+        """
+        Returns the points that can be reached from POSITION in one teleport.
+        :param position:    Any (x, y) position, which does not need to be in this graph.
+        :return:            A list of the indices of the reachable points, and a list of
+                            the distance to each of them.
+        """
+
+        x, y = position
+        tolerance = self.tolerance
+        delta = tolerance / math.sqrt(2)
+        points = self.points
+
+        # Horizontal teleports to either side, keeping both short and long ones
+        candidates = []
+        for x_min, x_max in ((x + tolerance / 4, x + tolerance * 2),
+                             (x - tolerance * 2, x - tolerance / 4)):
+            row = search_sorted(points, x_min, x_max, y - delta, y + delta)
+            if len(row) > HORIZONTAL_NEIGHBORS:
+                # ROW is already sorted by x-position, so spread evenly over its indices
+                spread = np.arange(HORIZONTAL_NEIGHBORS) * (len(row) - 1)
+                row = row[spread // (HORIZONTAL_NEIGHBORS - 1)]
+            candidates.append(row)
+
+        # Vertical teleports up and down to the nearest points in the same column
+        for y_min, y_max in ((y + tolerance / 4, 1), (0, y - tolerance / 4)):
+            column = search_sorted(points, x - delta, x + delta, y_min, y_max)
+            if len(column) > VERTICAL_NEIGHBORS:
+                gaps = np.abs(points[column, 1] - y)
+                column = column[np.argpartition(gaps, VERTICAL_NEIGHBORS)[:VERTICAL_NEIGHBORS]]
+            candidates.append(column)
+
+        vertices = np.concatenate(candidates)
+        costs = np.hypot(points[vertices, 0] - x, points[vertices, 1] - y)
+        return vertices.tolist(), costs.tolist()
+
+    def shortest_path(self, source, target):
+        """
+        Finds a short sequence of teleports from SOURCE to within the move tolerance of
+        TARGET using the weighted A* search algorithm, so the path found is at most
+        HEURISTIC_WEIGHT times longer than the shortest one. Each point is expanded at most
+        once, and at most MAX_EXPANSIONS points are expanded in total.
+        :param source:  The position to start at.
+        :param target:  The destination.
+        :return:        A list of the points visited between SOURCE and TARGET. If TARGET
+                        cannot be reached, the path leads to the closest point that can be.
+        """
+
+        tolerance = self.tolerance
+        xs, ys = self.xs, self.ys
+        source_edges = self.reachable(source)
+
+        # Head for the closest point to TARGET that is connected to SOURCE, so that searches
+        # towards unreachable targets do not use up their expansions for nothing
+        connected = np.flatnonzero(np.isin(self.components, self.components[source_edges[0]]))
+        if len(connected):
+            gaps = np.hypot(self.points[connected, 0] - target[0],
+                            self.points[connected, 1] - target[1])
+            closest = int(np.argmin(gaps))
+            if gaps[closest] > tolerance:
+                target = (xs[connected[closest]], ys[connected[closest]])
+        target_x, target_y = target
+
+        # The source is vertex -1 since it is usually not one of the graph's points
+        distances = {-1: 0}
+        errors = {}                 # Distance from each reached point to TARGET
+        edge_to = {}
+        closed = set()
+        fringe = [(0, 0, -1)]
+        pushed = 1
+        best, best_error = -1, utils.distance(source, target)
+        while fringe and len(closed) <= MAX_EXPANSIONS:
+            _, _, vertex = heappop(fringe)
+            if vertex in closed:
+                continue
+            closed.add(vertex)
+
+            if vertex == -1:
+                if best_error <= tolerance:
+                    break
+                neighbors, costs = source_edges
+            else:
+                error = errors[vertex]
+                if error < best_error:
+                    best, best_error = vertex, error
+                if error <= tolerance:
+                    break
+                neighbors, costs = self.neighbors(vertex)
+
+            distance = distances[vertex]
+            for neighbor, cost in zip(neighbors, costs):
+                new_distance = distance + cost
+                if neighbor not in closed and new_distance < distances.get(neighbor, math.inf):
+                    distances[neighbor] = new_distance
+                    edge_to[neighbor] = vertex
+                    error = errors.get(neighbor)
+                    if error is None:
+                        error = errors[neighbor] = math.hypot(xs[neighbor] - target_x,
+                                                              ys[neighbor] - target_y)
+                    estimate = HEURISTIC_WEIGHT * (error - tolerance) if error > tolerance else 0
+                    heappush(fringe, (new_distance + estimate, pushed, neighbor))
+                    pushed += 1
+
+        path = []
+        vertex = best
+        while vertex != -1:
+            path.append(tuple(self.points[vertex].tolist()))
+            vertex = edge_to[vertex]
+        return list(reversed(path))
+
+
+class PathCache:
+    """
+    A least-recently-used cache of shortest paths keyed by the cells that their source and
+    target fall in, so that a path found once is reused from anywhere near the same source.
+    """
+
+    def __init__(self, size=PATH_CACHE_SIZE):
+        """
+        Creates an empty PathCache.
+        :param size:    The maximum number of paths to keep.
+        """
+
+        self.size = size
+        self.paths = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, target, tolerance):
+        """
+        Returns the key of the path from SOURCE to TARGET.
+        :param source:      The position the path starts at.
+        :param target:      The destination of the path.
+        :param tolerance:   The move tolerance that the path was planned with.
+        :return:            A tuple of the cells containing SOURCE and TARGET.
+        """
+
+        cell = tolerance * PATH_CACHE_CELL
+        return (round(source[0] / cell), round(source[1] / cell),
+                round(target[0] / cell), round(target[1] / cell))
+
+    def get(self, key):
+        """Returns the path stored under KEY and marks it as recently used, None if absent."""
+
+        path = self.paths.get(key)
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.paths.move_to_end(key)
+        return path
+
+    def put(self, key, path):
+        """Stores PATH under KEY, evicting the least recently used path if the cache is full."""
+
+        self.paths[key] = path
+        self.paths.move_to_end(key)
+        if len(self.paths) > self.size:
+            self.paths.popitem(last=False)
+
+    def clear(self):
+        """Forgets every path, for example once the layout they were planned on has changed."""
+
+        self.paths.clear()
+
+    def stats(self):
+        """Returns the number of cache hits and misses, and the resulting hit rate."""
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0
+        }
+
+
 class Layout:
-    """Uses a quadtree to represent possible player positions in a map layout."""
+    """Uses a spatial index to represent possible player positions in a map layout."""
 
     TOLERANCE = settings.move_tolerance / 2
 
@@ -73,222 +477,264 @@ class Layout:
         """
 
         self.name = name
-        self.root = None
+        self.index = PointIndex()
+        self.graph = None           # NavigationGraph over the points in INDEX
+        self.paths = PathCache()    # Shortest paths found on the current graph
+        self.prefetched = OrderedDict()     # Maps targets to the (source, Future) of their path
+        self.lock = threading.Lock()
 
     @utils.run_if_enabled
     def add(self, x, y):
         """
-        Adds a Node to the quadtree at position (X, Y) if it does not already exist.
+        Adds a point to the layout at position (X, Y) if no other point is within TOLERANCE.
         :param x:   The x-position of the new point.
         :param y:   The y-position of the new point.
         :return:    None
         """
 
-        def add_helper(node):
-            if not node:
-                return Node(x, y)
-            if y >= node.y and x < node.x:
-                node.up_left = add_helper(node.up_left)
-            elif y >= node.y and x >= node.x:
-                node.up_right = add_helper(node.up_right)
-            elif y < node.y and x < node.x:
-                node.down_left = add_helper(node.down_left)
-            else:
-                node.down_right = add_helper(node.down_right)
-            return node
-
-        def check_collision(point):
-            return utils.distance(tuple(point), (x, y)) >= Layout.TOLERANCE
-
-        checks = map(check_collision, self.search(x - Layout.TOLERANCE,
-                                                  x + Layout.TOLERANCE,
-                                                  y - Layout.TOLERANCE,
-                                                  y + Layout.TOLERANCE))
-        if all(checks):
-            self.root = add_helper(self.root)
+        with self.lock:
+            nearby = self.index.search(x - Layout.TOLERANCE,
+                                       x + Layout.TOLERANCE,
+                                       y - Layout.TOLERANCE,
+                                       y + Layout.TOLERANCE)
+            if np.all(np.hypot(nearby[:, 0] - x, nearby[:, 1] - y) >= Layout.TOLERANCE):
+                self.index.add(x, y)
+                self.graph = None
 
     def search(self, x_min, x_max, y_min, y_max):
         """
-        Returns a list of all Nodes bounded horizontally by X_MIN and X_MAX, and bounded
+        Returns a list of all points bounded horizontally by X_MIN and X_MAX, and bounded
         vertically by Y_MIN and Y_MAX.
         :param x_min:   The left boundary of the range.
         :param x_max:   The right boundary of the range.
         :param y_min:   The bottom boundary of the range.
         :param y_max:   The top boundary of the range.
-        :return:        A list of all Nodes in the range.
+        :return:        A list of all (x, y) points in the range.
         """
 
-        nodes = []
-
-        def search_helper(node):
-            if node:
-                if x_min <= node.x <= x_max and y_min <= node.y <= y_max:
-                    nodes.append(node)
-                if x_min < node.x:
-                    if y_min < node.y:
-                        search_helper(node.down_left)
-                    if y_max >= node.y:
-                        search_helper(node.up_left)
-                if x_max >= node.x:
-                    if y_min < node.y:
-                        search_helper(node.down_right)
-                    if y_max >= node.y:
-                        search_helper(node.up_right)
-
-        search_helper(self.root)
-        return nodes
+        return [tuple(p) for p in self.index.search(x_min, x_max, y_min, y_max).tolist()]
 
     def shortest_path(self, source, target):
         """
         Returns the shortest path from A to B using horizontal and vertical teleports.
-        This method uses a variant of the A* search algorithm.
+        This method runs the weighted A* search algorithm over this Layout's NavigationGraph.
         :param source:  The position to start at.
         :param target:  The destination.
-        :return:        A list of all Nodes on the shortest path in order.
-        """
-
-        fringe = []
-        vertices = [source]
-        distances = [0]
-        edge_to = [0]
-
-        def push_neighbors(index):
-            """
-            Adds possible Nodes that can be reached from POINT (using only one or
-            two teleports) to the fringe. The Nodes that are returned are all closer
-            to TARGET than POINT is.
-            :param index:   The index of the current position.
-            :return:        None
-            """
-
-            point = vertices[index]
-
-            def push_best(nodes):
-                """
-                Pushes the Node closest to TARGET to the fringe.
-                :param nodes:   A list of points to compare.
-                :return:        None
-                """
-
-                if nodes:
-                    points = [tuple(n) for n in nodes]
-                    closest = utils.closest_point(points, target)
-
-                    # Push to the fringe
-                    distance = distances[index] + utils.distance(point, closest)
-                    heuristic = distance + utils.distance(closest, target)
-                    heappush(fringe, (heuristic, len(vertices)))
-
-                    # Update vertex and edge lists to include the new node
-                    vertices.append(closest)
-                    distances.append(distance)
-                    edge_to.append(index)
-
-            x_error = (target[0] - point[0])
-            y_error = (target[1] - point[1])
-            delta = settings.move_tolerance / math.sqrt(2)
-
-            # Push best possible node using horizontal teleport
-            if abs(x_error) > settings.move_tolerance:
-                if x_error > 0:
-                    x_min = point[0] + settings.move_tolerance / 4
-                    x_max = point[0] + settings.move_tolerance * 2
-                else:
-                    x_min = point[0] - settings.move_tolerance * 2
-                    x_max = point[0] - settings.move_tolerance / 4
-                candidates = self.search(x_min,
-                                         x_max,
-                                         point[1] - delta,
-                                         point[1] + delta)
-                push_best(candidates)
-
-            # Push best possible node using vertical teleport
-            if abs(y_error) > settings.move_tolerance:
-                if y_error > 0:
-                    y_min = point[1] + settings.move_tolerance / 4
-                    y_max = 1
-                else:
-                    y_min = 0
-                    y_max = point[1] - settings.move_tolerance / 4
-                candidates = self.search(point[0] - delta,
-                                         point[0] + delta,
-                                         y_min,
-                                         y_max)
-                push_best(candidates)
-
-        # Perform the A* search algorithm
-        i = 0
-        while utils.distance(vertices[i], target) > settings.move_tolerance:
-            push_neighbors(i)
-            if len(fringe) == 0:
-                break
-            i = heappop(fringe)[1]
-
-        # Extract and return shortest path
-        path = [target]
-        while i != 0:
-            path.append(vertices[i])
-            i = edge_to[i]
-
-        path.append(source)
-        path = list(reversed(path))
+        :return:        A list of all points on the shortest path in order.
+        """
+
+        # Reuse the prefetched path if it was planned from around here on the current graph
+        waypoints = None
+        prefetched = self.prefetched.pop(target, None)
+        if prefetched is not None \
+                and utils.distance(prefetched[0], source) <= settings.move_tolerance:
+            graph, planned = prefetched[1].result()
+            if graph is not None and graph is self.graph \
+                    and graph.tolerance == settings.move_tolerance:
+                waypoints = planned
+
+        if waypoints is None:
+            _, waypoints = self._plan(source, target)
+        path = [source] + waypoints + [target]
         config.path = path.copy()
         return path
 
+    def prefetch(self, source, target):
+        """
+        Starts planning the path from SOURCE to TARGET in a background thread. A later call
+        to shortest_path towards TARGET from near SOURCE reuses the result instead of
+        planning again, waiting for it if it is not ready yet. Prefetched paths are kept
+        per target, so several Points ahead can be planned without replacing each other.
+        :param source:  The position that the path is expected to start from.
+        :param target:  The destination.
+        :return:        None
+        """
+
+        future = Future()
+        prefetched = self.prefetched
+        prefetched[target] = (source, future)
+        prefetched.move_to_end(target)
+        if len(prefetched) > PREFETCH_SIZE:
+            prefetched.popitem(last=False)
+
+        def plan():
+            result = (None, None)
+            try:
+                result = self._plan(source, target)
+            finally:
+                future.set_result(result)
+
+        thread = threading.Thread(target=plan)
+        thread.daemon = True
+        thread.start()
+
+    def _plan(self, source, target):
+        """
+        Finds the waypoints between SOURCE and TARGET on the current NavigationGraph,
+        rebuilding the graph first if the layout or move tolerance has changed.
+        :param source:  The position to start at.
+        :param target:  The destination.
+        :return:        The NavigationGraph that was searched and the list of waypoints.
+        """
+
+        with self.lock:
+            tolerance = settings.move_tolerance
+            if self.graph is None or self.graph.tolerance != tolerance:
+                self.graph = NavigationGraph(self.index.sorted(), tolerance)
+                self.paths.clear()
+
+            key = PathCache.key(source, target, tolerance)
+            waypoints = self.paths.get(key)
+            if waypoints is None:
+                waypoints = self.graph.shortest_path(source, target)
+                self.paths.put(key, waypoints)
+            return self.graph, waypoints
+
     def draw(self, image):
         """
-        Draws the points in this QuadTree onto IMAGE using in-order traversal.
+        Draws the points in this Layout onto IMAGE.
         :param image:   The image to draw on.
         :return:        None
         """
 
-        def draw_helper(node):
-            if node:
-                draw_helper(node.up_left)
-                draw_helper(node.down_left)
+        points = self.index.all()
+        xs = np.rint(points[:, 0] * image.shape[1]).astype(int)
+        ys = np.rint(points[:, 1] * config.capture.minimap_ratio * image.shape[0]).astype(int)
+        for center in zip(xs.tolist(), ys.tolist()):
+            cv2.circle(image, center, 1, (255, 165, 0), -1)
+
+    def __getstate__(self):
+        """
+        Returns the attributes of this Layout to pickle, leaving out anything that is
+        derived from its points or only used at runtime.
+        :return:    A dictionary of attributes.
+        """
 
-                center = utils.convert_to_absolute(tuple(node), image)
-                cv2.circle(image, center, 1, (255, 165, 0), -1)
+        state = self.__dict__.copy()
+        for key in ('graph', 'paths', 'prefetched', 'lock'):
+            state.pop(key, None)
+        return state
 
-                draw_helper(node.up_right)
-                draw_helper(node.down_right)
+    def __setstate__(self, state):
+        """
+        Restores a pickled Layout, converting the quadtree of Layouts saved by earlier
+        versions into a PointIndex.
+        :param state:   The pickled attributes of the Layout.
+        :return:        None
+        """
 
-        draw_helper(self.root)
+        root = state.pop('root', None)
+        self.__dict__.update(state)
+        self.graph = None
+        self.paths = PathCache()
+        self.prefetched = OrderedDict()
+        self.lock = threading.Lock()
+        if 'index' not in state:
+            points = []
+            stack = [root] if root else []
+            while stack:
+                node = stack.pop()
+                points.append((node.x, node.y))
+                stack.extend(node.children())
+            self.index = PointIndex(points)
 
     @staticmethod
     def load(routine):
         """
-        Loads the Layout object associated with ROUTINE. Creates and returns a
-        new Layout if the specified Layout does not exist.
+        Loads the Layout object associated with ROUTINE. Layouts pickled by earlier versions
+        are converted to the current file format. Creates and returns a new Layout if the
+        specified Layout does not exist.
         :param routine:     The routine associated with the desired Layout.
         :return:            A Layout instance.
         """
 
         layout_name = splitext(basename(routine))[0]
         target = os.path.join(get_layouts_dir(), layout_name)
-        if isfile(target):
-            print(f" -  Found existing Layout file at '{target}'.")
+        if isfile(target + LAYOUT_EXTENSION):
+            print(f" -  Found existing Layout file at '{target + LAYOUT_EXTENSION}'.")
+            return Layout.read(target + LAYOUT_EXTENSION, layout_name)
+        elif isfile(target):
+            print(f" -  Converting pickled Layout file at '{target}'.")
             with open(target, 'rb') as file:
-                return pickle.load(file)
+                layout = LegacyUnpickler(file).load()
+            layout.name = layout_name
+            layout.write(target + LAYOUT_EXTENSION)
+            return layout
         else:
-            print(f" -  Created new Layout file at '{target}'.")
+            print(f" -  Created new Layout file at '{target + LAYOUT_EXTENSION}'.")
             new_layout = Layout(layout_name)
             new_layout.save()
             return new_layout
 
+    @staticmethod
+    def read(path, name):
+        """
+        Memory-maps the layout file at PATH. Only its header is read up front.
+        :param path:    The path of the layout file.
+        :param name:    The name of the Layout.
+        :return:        A Layout instance.
+        """
+
+        with open(path, 'rb') as file:
+            magic, version, count = LAYOUT_HEADER.unpack(file.read(LAYOUT_HEADER.size))
+        if magic != LAYOUT_MAGIC:
+            raise ValueError(f"'{path}' is not a layout file")
+        if version != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported layout file version {version} in '{path}'")
+
+        layout = Layout(name)
+        if count:
+            points = np.memmap(path, dtype='<f4', mode='r',
+                               offset=LAYOUT_HEADER_SIZE, shape=(count, 2))
+            layout.index = PointIndex.from_sorted(points)
+        return layout
+
     @utils.run_if_enabled
     def save(self):
         """
-        Pickles this Layout instance to a file that is named after the routine in which
-        this Layout was generated.
+        Saves this Layout to a file that is named after the routine in which this Layout
+        was generated.
         :return:    None
         """
 
         layouts_dir = get_layouts_dir()
         if not os.path.exists(layouts_dir):
             os.makedirs(layouts_dir)
-        with open(join(layouts_dir, self.name), 'wb') as file:
-            pickle.dump(self, file)
+        self.write(join(layouts_dir, self.name + LAYOUT_EXTENSION))
+
+    def write(self, path):
+        """
+        Writes the points of this Layout to PATH as a header followed by a contiguous array
+        of little-endian float32 (x, y) pairs sorted by x-position.
+        :param path:    The path to write the layout file to.
+        :return:        None
+        """
+
+        with self.lock:
+            # Stop using a file that this Layout was read from so that it can be overwritten
+            points = np.array(self.index.sorted(), dtype=np.float64)
+            self.index.points = points
+            self.graph = None
+            self.prefetched = OrderedDict()
+
+            with open(path, 'wb') as file:
+                header = LAYOUT_HEADER.pack(LAYOUT_MAGIC, LAYOUT_VERSION, len(points))
+                file.write(header.ljust(LAYOUT_HEADER_SIZE, b'\0'))
+                file.write(points.astype('<f4').tobytes())
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickles Layouts saved by earlier versions, refusing to load anything other than the
+    classes that such Layouts are made of.
+    """
+
+    ALLOWED = {('src.routine.layout', 'Layout'), ('src.routine.layout', 'Node')}
+
+    def find_class(self, module, name):
+        if (module, name) not in LegacyUnpickler.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load '{module}.{name}' from a layout")
+        return super().find_class(module, name)
 
 
 def get_layouts_dir():